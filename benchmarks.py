@@ -0,0 +1,226 @@
+import sys
+import copy
+import json
+import math
+import time
+import timeit
+import argparse
+import tracemalloc
+import numpy as np
+from env import Estimation
+from functions import change_state, process_action, calculate_rewards
+
+
+def midgame_env(steps=30, seed=0, **kwargs):
+	"""
+	A function which returns an environment played with random actions for a number of steps
+	"""
+	env = Estimation(players=list('ABCD'), **kwargs)
+	env.reset(seed=seed)
+	for _ in range(steps):
+		env.step(env.action_space.sample())
+	return env
+
+
+def rate(func, number, repeat=5):
+	"""
+	A function which returns the calls per second of func, from the fastest of repeated runs
+	"""
+	return number / min(timeit.repeat(func, number=number, repeat=repeat))
+
+
+def per_call(func, number, setup=None, repeat=5):
+	"""
+	A function which returns the microseconds per call of func from the fastest of repeated runs,
+	calling setup untimed before each call
+	"""
+	if setup is None:
+		return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+	totals = []
+	for _ in range(repeat):
+		total = 0
+		for _ in range(number):
+			setup()
+			start = time.perf_counter()
+			func()
+			total += time.perf_counter() - start
+		totals.append(total)
+	return min(totals) / number * 1e6
+
+
+def play_game(env):
+	"""
+	A function which plays a game with random actions and returns its number of steps
+	"""
+	env.reset()
+	steps, done = 0, False
+	while not done:
+		_, _, done, _ = env.step(env.action_space.sample())
+		steps += 1
+	return steps
+
+
+def bench_games(games=200, seed=0):
+	"""
+	A function which measures the games and steps per second of Estimation.reset and step
+	under action_space.sample
+	"""
+	env = Estimation(players=list('ABCD'))
+	env.reset(seed=seed)
+	start = time.perf_counter()
+	steps = sum(play_game(env) for _ in range(games))
+	elapsed = time.perf_counter() - start
+	return {'games': games / elapsed, 'steps': steps / elapsed}
+
+
+def bench_calls(number=2000, seed=0):
+	"""
+	A function which measures the microseconds per call of the functions called by Estimation.step
+	"""
+	env = midgame_env(seed=seed)
+	info = env.update_info()
+	action = [np.random.rand(52), np.random.rand(14), np.random.rand(4)]
+	results = {
+		'change_state': per_call(lambda: change_state(env), number),
+		'process_action': per_call(lambda: process_action(action, env, info), number),
+		'calculate_rewards': per_call(lambda: calculate_rewards(env), number),
+		'update_scores': per_call(env.update_scores, number),
+		'update_info': per_call(env.update_info, number),
+	}
+
+	# a full table, its trick being logged into a record rewound before each call
+	env = midgame_env(steps=20, seed=seed)
+	while len(env.table) < 3:
+		env.step(env.action_space.sample())
+	env.play_card(env.current_player(), env.action_space.sample())
+	winner = env.evaulate_winner()
+	results['evaulate_winner'] = per_call(env.evaulate_winner, number)
+	snapshot = env.record.snapshot()
+	results['update_record'] = per_call(lambda: env.update_record(winner), number, lambda: env.record.restore(snapshot, env))
+
+	# the four bids made, the game being restored before each call
+	env = midgame_env(steps=3, seed=seed)
+	env.bid(env.current_player(), env.action_space.sample())
+	snapshot = env.snapshot()
+	results['select_highest_bid'] = per_call(env.select_highest_bid, number, lambda: env.restore(snapshot))
+	return results
+
+
+def bench_memory(games=20, seed=0):
+	"""
+	A function which measures the peak memory allocated in KiB while playing a game
+	"""
+	env = Estimation(players=list('ABCD'))
+	env.reset(seed=seed)
+	peaks = []
+	for _ in range(games):
+		tracemalloc.start()
+		play_game(env)
+		peaks.append(tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+	return {'peak_kib_per_game': np.mean(peaks) / 1024}
+
+
+def bench_snapshot(number=5000, seed=0):
+	"""
+	A function which measures snapshots, restores and clones per second against copy.deepcopy
+	"""
+	env = midgame_env(seed=seed, recording=False)
+	snapshot = env.snapshot()
+	return {
+		'snapshot': rate(env.snapshot, number),
+		'restore': rate(lambda: env.restore(snapshot), number),
+		'clone': rate(env.clone, number),
+		'deepcopy': rate(lambda: copy.deepcopy(env), max(number // 20, 1)),
+	}
+
+
+def bench_reset(number=2000, seed=0):
+	"""
+	A function which measures the microseconds per reset, with and without the game record and
+	full info, and the memory allocated in KiB per reset environment
+	"""
+	env = Estimation(players=list('ABCD'))
+	env.reset(seed=seed)
+	lean = Estimation(players=list('ABCD'), recording=False, info_fields=['current_player', 'legal_cards'])
+	lean.reset(seed=seed)
+
+	envs = max(number // 20, 1)
+	tracemalloc.start()
+	kept = [Estimation(players=list('ABCD')) for _ in range(envs)]
+	for kept_env in kept:
+		kept_env.reset(seed=seed)
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return {
+		'reset_us': per_call(env.reset, number),
+		'lean_reset_us': per_call(lean.reset, number),
+		'kib_per_env': memory / envs / 1024,
+	}
+
+
+# benchmark name, function, its default amount of work and whether higher results are better
+BENCHMARKS = [
+	('per_second', bench_games, 200, True),
+	('us_per_call', bench_calls, 2000, False),
+	('memory', bench_memory, 20, False),
+	('snapshot_per_second', bench_snapshot, 5000, True),
+	('reset', bench_reset, 2000, False),
+]
+
+
+def run(seed=0, quick=False):
+	"""
+	A function which runs every benchmark from a fixed seed and returns the results by benchmark
+	"""
+	results = {}
+	for name, func, number, _ in BENCHMARKS:
+		np.random.seed(seed)
+		# a quick run does a tenth of the default work
+		results[name] = func(max(number // 10, 1) if quick else number, seed)
+	return results
+
+
+def compare(results, baseline, threshold=0.2):
+	"""
+	A function which returns the regressions of results against a baseline, as lines naming the measure,
+	its baseline and current values, where a measure regressed when it's worse by more than threshold
+	"""
+	regressions = []
+	for name, _, _, higher in BENCHMARKS:
+		for key, value in results.get(name, {}).items():
+			if key not in baseline.get(name, {}):
+				continue
+			base = baseline[name][key]
+			# any change from a zero baseline is an infinite relative change
+			if base:
+				change = (value - base) / abs(base)
+			else:
+				change = math.copysign(math.inf, value) if value else 0.0
+			if (-change if higher else change) > threshold:
+				regressions.append('{}.{}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, key, base, value, change))
+	return regressions
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark Estimation and print the results as JSON')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--quick', action='store_true', help='run a tenth of the default work')
+	parser.add_argument('--output', help='file to write the results to')
+	parser.add_argument('--compare', help='baseline results file to fail against on regressions')
+	parser.add_argument('--threshold', type=float, default=0.2, help='relative regression allowed by --compare')
+	args = parser.parse_args()
+
+	results = run(args.seed, args.quick)
+	print(json.dumps(results, indent=2))
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2)
+
+	if args.compare:
+		with open(args.compare) as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		for regression in regressions:
+			print('regression', regression, file=sys.stderr)
+		sys.exit(1 if regressions else 0)
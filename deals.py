@@ -0,0 +1,52 @@
+import argparse
+import numpy as np
+
+
+def generate_deals(n, seed=None, chunk=1000000):
+	"""
+	A function which returns an (n, 52) uint8 array of deals, each a random permutation of the
+	card tokens dealt the way Estimation.reset(deal=...) and VectorEstimation.reset(deals) deal them
+	"""
+	return fill_deals(np.empty((n, 52), dtype=np.uint8), seed, chunk)
+
+
+def save_deals(path, n, seed=None, chunk=1000000):
+	"""
+	A function which writes n deals to a .npy file a chunk at a time, so corpora larger than
+	memory can be generated
+	"""
+	deals = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(n, 52))
+	fill_deals(deals, seed, chunk)
+	deals.flush()
+	return deals
+
+
+def fill_deals(deals, seed, chunk):
+	"""
+	A function which fills the rows of a deals array with random permutations of the card tokens
+	"""
+	rng = np.random.default_rng(seed)
+	tokens = np.arange(52, dtype=np.uint8)
+	for start in range(0, len(deals), chunk):
+		n = min(chunk, len(deals) - start)
+		deals[start:start + n] = rng.permuted(np.broadcast_to(tokens, (n, 52)), axis=1)
+	return deals
+
+
+def load_deals(path):
+	"""
+	A function which memory-maps a deal corpus, rows being read from disk only when used
+	"""
+	deals = np.load(path, mmap_mode='r')
+	if deals.ndim != 2 or deals.shape[1] != 52:
+		raise ValueError('a deal corpus is an (n, 52) array of card tokens, got shape {}'.format(deals.shape))
+	return deals
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Generate a corpus of Estimation deals as an (n, 52) uint8 .npy file')
+	parser.add_argument('path')
+	parser.add_argument('-n', type=int, default=1000000, help='number of deals')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+	save_deals(args.path, args.n, args.seed)
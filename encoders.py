@@ -0,0 +1,171 @@
+import numpy as np
+from functions import change_state
+
+# encoder classes by name, filled by register_encoder
+ENCODERS = {}
+
+# encoder instances by name and dtype, shared as they keep no state between calls
+CACHE = {}
+
+
+def register_encoder(name):
+	"""
+	A function which returns a class decorator adding an encoder to the registry under a name
+	"""
+	def register(cls):
+		cls.name = name
+		ENCODERS[name] = cls
+		return cls
+	return register
+
+
+def get_encoder(name, dtype=np.float32):
+	"""
+	A function which returns the cached encoder of a name, or of a list of names concatenated,
+	producing observations of a dtype. Encoders are state functions, to be passed to Estimation
+	"""
+	names = (name,) if isinstance(name, str) else tuple(name)
+	unknown = [name for name in names if name not in ENCODERS]
+	if unknown:
+		raise ValueError('unknown encoders {}, the encoders are {}'.format(unknown, list(ENCODERS)))
+
+	key = (names, np.dtype(dtype).str)
+	if key not in CACHE:
+		encoders = [ENCODERS[name](dtype) for name in names]
+		CACHE[key] = encoders[0] if len(names) == 1 else Concatenated(encoders, dtype)
+	return CACHE[key]
+
+
+class Encoder:
+	"""
+	A class which encodes the observation of the current player into a preallocated buffer
+
+	Subclasses set the shape of their observations and fill the buffer given the environment and
+	the current player's seat, the other players being ordered by how many seats they sit after.
+	Calling an encoder returns a copy of the buffer, so observations can be kept.
+	"""
+	shape = ()
+
+	def __init__(self, dtype=np.float32):
+		self.dtype = np.dtype(dtype)
+		self.buffer = np.zeros(self.shape, dtype=self.dtype)
+
+
+	def __call__(self, env):
+		self.fill(env, env.seats[env.current_player()], self.buffer)
+		return self.buffer.copy()
+
+
+	def fill(self, env, seat, out):
+		raise NotImplementedError
+
+
+	def __repr__(self):
+		return '{}({})'.format(type(self).__name__, self.dtype.name)
+
+
+# the seats of the player of a seat and of the players sitting 1, 2 and 3 seats after them
+RELATIVE_SEATS = (np.arange(4)[:, None] + np.arange(4)) % 4
+
+
+@register_encoder('label')
+class LabelEncoder(Encoder):
+	"""
+	The 65 element change_state observation in a dtype
+	"""
+	shape = (65,)
+
+	def fill(self, env, seat, out):
+		out[:] = change_state(env)
+
+
+@register_encoder('planes')
+class PlanesEncoder(Encoder):
+	"""
+	One-hot card location planes of shape (4, 52): the cards in the player's hand, on the table,
+	played in previous tricks and unseen, in the other players' hands
+	"""
+	shape = (4, 52)
+
+	def fill(self, env, seat, out):
+		hands = env.hand_masks
+		out[0] = hands[seat]
+		out[1] = 0
+		out[1, env.table] = 1
+		out[2] = 0
+		out[2, env.played] = 1
+		out[3] = hands.any(axis=0) & ~hands[seat]
+
+
+@register_encoder('suit_counts')
+class SuitCountsEncoder(Encoder):
+	"""
+	The counts of cards per suit of shape (2, 4): in the player's hand, and remaining unseen in the
+	other players' hands
+	"""
+	shape = (2, 4)
+
+	def fill(self, env, seat, out):
+		hands = env.hand_masks.reshape(4, 4, 13).sum(axis=2)
+		out[0] = hands[seat]
+		out[1] = hands.sum(axis=0) - hands[seat]
+
+
+@register_encoder('voids')
+class VoidsEncoder(Encoder):
+	"""
+	The suits each of the other players is known to be void in, of shape (3, 4)
+	"""
+	shape = (3, 4)
+
+	def fill(self, env, seat, out):
+		out[:] = env.void_masks[RELATIVE_SEATS[seat, 1:]]
+
+
+@register_encoder('history')
+class HistoryEncoder(Encoder):
+	"""
+	The bid and trick history of every player from the current one, of shape (4, 15): the estimated
+	tricks of their bid or call, the trump suit of their bid plus 1 (0 once it's a call or before they
+	bid) and 1 for every trick they won, by round
+	"""
+	shape = (4, 15)
+
+	def fill(self, env, seat, out):
+		state = env.seat_state
+		seats = RELATIVE_SEATS[seat]
+		out[:, 0] = state.estimates[seats] * state.bid_made[seats]
+		out[:, 1] = (state.bid_trumps[seats] + 1) * state.bid_made[seats]
+		out[:, 2:] = state.won[seats]
+
+
+class Concatenated(Encoder):
+	"""
+	A class which concatenates the flattened observations of several encoders
+	"""
+	def __init__(self, encoders, dtype=np.float32):
+		self.encoders = encoders
+		self.shape = (sum(int(np.prod(encoder.shape)) for encoder in encoders),)
+		super().__init__(dtype)
+		self.name = [encoder.name for encoder in encoders]
+
+		# each encoder fills its slice of the buffer
+		self.views, start = [], 0
+		for encoder in encoders:
+			size = int(np.prod(encoder.shape))
+			self.views.append(self.buffer[start:start + size].reshape(encoder.shape))
+			start += size
+
+
+	def fill(self, env, seat, out):
+		for encoder, view in zip(self.encoders, self.views):
+			encoder.fill(env, seat, view)
+
+
+	def __reduce__(self):
+		# the views of the buffer are rebuilt on unpickling, which would copy them apart
+		return Concatenated, (self.encoders, self.dtype)
+
+
+	def __repr__(self):
+		return 'Concatenated({}, {})'.format(self.name, self.dtype.name)
@@ -1,66 +1,578 @@
 import numpy as np
 import copy
-from collections import defaultdict, Counter
+from collections import defaultdict
+from collections.abc import Sequence, MutableMapping, KeysView, ItemsView, ValuesView
 from functions import *
 from spaces import *
+from profiling import Profiler
 
 class Cards:
 	"""
 	A class representing a deck of cards
 	"""
 	def __init__(self):
-		self.suits = ['C', 'D', 'H', 'S']
-		self.ranks = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-		self.cards = [(rank, suit) for suit in self.suits for rank in self.ranks]
-		self.card_to_token = {card: i for i, card in enumerate(self.cards)}
-		self.token_to_card = {i: card for i, card in enumerate(self.cards)}
+		self.suits = SUITS
+		self.ranks = RANKS
+		self.cards = list(CARDS)
+		self.card_to_token = CARD_TO_TOKEN
+		self.token_to_card = dict(enumerate(CARDS))
 
 
-	def shuffle(self):
-		np.random.shuffle(self.cards) 
+	def shuffle(self, rng=np.random):
+		rng.shuffle(self.cards) 
+
+
+# the deck shared by all environments, deals being permutations of its card tokens
+DECK = Cards()
+
+# seat taking each card of a deal, the deck being dealt one card at a time from its end
+DEAL_SEATS = (51 - np.arange(52)) % 4
+
+# every call and every trump suit, copied as the legal masks when none is ruled out
+ALL_CALLS = np.ones(14, dtype=bool)
+ALL_TRUMPS = np.ones(4, dtype=bool)
+
+
+class CardView(Sequence):
+	"""
+	A class representing a read-only list of (rank, suit) cards, built lazily from a list
+	of card tokens or a hand mask on first access and kept from then on
+	"""
+	def __init__(self, tokens):
+		self.tokens = tokens
+		self.list = None
+
+
+	def cards(self):
+		if self.list is None:
+			tokens = np.flatnonzero(self.tokens) if isinstance(self.tokens, np.ndarray) else self.tokens
+			self.list = [CARDS[token] for token in tokens]
+		return self.list
+
+
+	def __getitem__(self, i):
+		return self.cards()[i]
+
+
+	def __len__(self):
+		return len(self.cards())
+
+
+	def __eq__(self, other):
+		return self.cards() == list(other)
+
+
+	def __repr__(self):
+		return repr(self.cards())
+
+
+class PlayersCards(MutableMapping):
+	"""
+	A class representing the players' hands as lists of (rank, suit) cards over the hand masks
+	"""
+	def __init__(self, hands):
+		self.hands = hands
+
+
+	def __getitem__(self, player):
+		return CardView(self.hands[player]).cards()
+
+
+	def __setitem__(self, player, cards):
+		hand = self.hands[player]
+		hand[:] = False
+		hand[[CARD_TO_TOKEN[card] for card in cards]] = True
+
+
+	def __delitem__(self, player):
+		del self.hands[player]
+
+
+	def __iter__(self):
+		return iter(self.hands)
+
+
+	def __len__(self):
+		return len(self.hands)
+
+
+class SeatState:
+	"""
+	A class holding the seat-indexed arrays of a game's hands, voids, bids, tricks and score
+	multipliers, allocated once per environment and zeroed by every reset
+
+	The arrays are views of one bool and one int buffer, so resetting or copying the state
+	touches two arrays
+	"""
+	__slots__ = ('masks', 'ints', 'hand_masks', 'void_masks', 'bid_made', 'estimates', 'bid_trumps', 'won_counts', 'multi', 'won', 'n_tricks')
+
+	def __init__(self):
+		self.masks = np.zeros(4 * 52 + 4 * 4 + 4, dtype=bool)
+		self.ints = np.zeros(4 * 4 + 4 * 13, dtype=np.int16)
+		self.views()
+		self.reset()
+
+
+	def views(self):
+		self.hand_masks = self.masks[:208].reshape(4, 52)
+		self.void_masks = self.masks[208:224].reshape(4, 4)
+		self.bid_made = self.masks[224:]
+		self.estimates = self.ints[0:4]
+		self.bid_trumps = self.ints[4:8]  # trump suit of a bidding phase bid, -1 once it's a call
+		self.won_counts = self.ints[8:12]
+		self.multi = self.ints[12:16]
+		self.won = self.ints[16:].reshape(4, 13)  # 1 for every trick a seat won, by round
+
+
+	def reset(self):
+		self.masks[:] = False
+		self.ints[:] = 0
+		self.bid_trumps[:] = -1
+		self.n_tricks = 0
+
+
+	def snapshot(self):
+		return self.masks.copy(), self.ints.copy(), self.n_tricks
+
+
+	def restore(self, snapshot):
+		"""
+		A method which copies a snapshot into the buffers, which stay the same objects
+		"""
+		self.masks[:], self.ints[:], self.n_tricks = snapshot
+
+
+	def __getstate__(self):
+		# the views are rebuilt on unpickling, which would copy them apart from the buffers
+		return self.masks, self.ints, self.n_tricks
+
+
+	def __setstate__(self, state):
+		self.masks, self.ints, self.n_tricks = state
+		self.views()
+
+
+class SeatMapping(MutableMapping):
+	"""
+	A class representing a per-player view of the seat arrays of a SeatState, iterating over the
+	players holding a value in seat order
+	"""
+	__slots__ = ('state', 'seats')
+
+	def __init__(self, state, seats):
+		self.state = state
+		self.seats = seats
+
+
+	def __iter__(self):
+		return (player for player, seat in self.seats.items() if self.has(seat))
+
+
+	def __len__(self):
+		return sum(1 for seat in self.seats.values() if self.has(seat))
+
+
+	def __repr__(self):
+		return repr(dict(self))
+
+
+class SeatRows(SeatMapping):
+	"""
+	A class representing the rows of a seat array by player, e.g. the players' hand masks, every
+	row being a view of the array
+	"""
+	__slots__ = ('rows',)
+
+	def __init__(self, state, seats, rows):
+		super().__init__(state, seats)
+		self.rows = rows
+
+
+	def has(self, seat):
+		return True
+
+
+	def __getitem__(self, player):
+		return self.rows[self.seats[player]]
+
+
+	def __setitem__(self, player, row):
+		self.rows[self.seats[player]] = row
+
+
+	def __delitem__(self, player):
+		self.rows[self.seats[player]] = False
+
+
+class Bids(SeatMapping):
+	"""
+	A class representing the players' bids, as [estimated tricks, trump suit] lists during the bidding
+	phase and estimated tricks once the bidder is selected, players yet to bid holding an empty list
+	"""
+	__slots__ = ()
+
+	def has(self, seat):
+		return self.state.bid_made[seat]
+
+
+	def __getitem__(self, player):
+		seat = self.seats[player]
+		state = self.state
+		if not state.bid_made[seat]:
+			return []
+		if state.bid_trumps[seat] >= 0:
+			return [int(state.estimates[seat]), int(state.bid_trumps[seat])]
+		return int(state.estimates[seat])
+
+
+	def __setitem__(self, player, bid):
+		seat = self.seats[player]
+		if isinstance(bid, (list, tuple)):
+			self.state.estimates[seat], self.state.bid_trumps[seat] = bid
+		else:
+			self.state.estimates[seat], self.state.bid_trumps[seat] = bid, -1
+		self.state.bid_made[seat] = True
+
+
+	def __delitem__(self, player):
+		self.state.bid_made[self.seats[player]] = False
+
+
+class Tricks(SeatMapping):
+	"""
+	A class representing the players' tricks as lists of 1 for every trick won and 0 for every trick lost
+	"""
+	__slots__ = ()
+
+	def has(self, seat):
+		return self.state.n_tricks > 0
+
+
+	def __getitem__(self, player):
+		return self.state.won[self.seats[player], :self.state.n_tricks].tolist()
+
+
+	def __setitem__(self, player, tricks):
+		seat = self.seats[player]
+		self.state.won[seat] = 0
+		self.state.won[seat, :len(tricks)] = tricks
+		self.state.won_counts[seat] = sum(tricks)
+		self.state.n_tricks = len(tricks)
+
+
+	def __delitem__(self, player):
+		seat = self.seats[player]
+		self.state.won[seat] = 0
+		self.state.won_counts[seat] = 0
+
+
+class Multipliers(SeatMapping):
+	"""
+	A class representing the players' score multipliers as lists of names over the bitfields
+	of the multiplier bits, which index the score table
+	"""
+	__slots__ = ()
+
+	@property
+	def bits(self):
+		return self.state.multi
+
+
+	def has(self, seat):
+		return self.state.multi[seat] != 0
+
+
+	def add(self, player, name):
+		self.state.multi[self.seats[player]] |= MULTI_BITS[name]
+
+
+	def __getitem__(self, player):
+		return multi_names(int(self.state.multi[self.seats[player]]))
+
+
+	def __setitem__(self, player, names):
+		self.state.multi[self.seats[player]] = 0
+		for name in names:
+			self.add(player, name)
+
+
+	def __delitem__(self, player):
+		self.state.multi[self.seats[player]] = 0
+
+
+class GameRecord(dict):
+	"""
+	A class representing a game record, which keeps the deal and a compact log of the tricks
+	with a row of leader seat, four card tokens, winner seat and trump/table suit byte per round.
+	The info of a round is rebuilt from them when looked up by its number
+
+	An environment resets its record in place for every game, so a record kept past the game
+	is a copy, see copy
+	"""
+	def __init__(self, players):
+		super().__init__()
+		self.tricks = np.zeros((13, 7), dtype=np.uint8)
+		self.deal = np.zeros((4, 52), dtype=bool)
+		self.reset(players)
+
+
+	def reset(self, players):
+		"""
+		A method which empties the record for a new game, zeroing its trick log and deal in place
+		"""
+		self.clear()
+		self['players'] = list(players)
+		self['rounds'] = 0
+		self.tricks[:] = 0
+		self['tricks'] = self.tricks
+		self.deal[:] = False
+		self['deal'] = self.deal
+		self.seats = {player: i for i, player in enumerate(players)}
+
+
+	def copy(self):
+		"""
+		A method which returns a record of the game sharing no arrays with this one
+		"""
+		return copy.deepcopy(self)
+
+
+	def snapshot(self):
+		return self.deal.copy(), self['rounds'], self.tricks.copy()
+
+
+	def restore(self, snapshot, env):
+		"""
+		A method which rewinds the record to a snapshot and points its keys at the restored game
+		"""
+		self.deal[:], self['rounds'], self.tricks[:] = snapshot
+		for key in ['bids', 'trump_suit', 'scores']:
+			self.pop(key, None)
+		if not env.phase_1:
+			self['bids'] = dict(env.bids)
+			self['trump_suit'] = env.trump_suit
+		if env.done:
+			self['scores'] = env.scores
+
+
+	def log_trick(self, leader, table, winner, trump_suit_token, table_suit_token):
+		self['tricks'][self['rounds']] = [self.seats[leader], *table, self.seats[winner], trump_suit_token << 4 | table_suit_token]
+		self['rounds'] += 1
+
+
+	def __missing__(self, key):
+		if self.is_round(key):
+			return self.round_info(key)
+		raise KeyError(key)
+
+
+	def is_round(self, key):
+		return isinstance(key, (int, np.integer)) and not isinstance(key, bool) and 1 <= key <= self['rounds']
+
+
+	# the rounds played are keys of the record like the stored keys, their info being rebuilt when read
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or self.is_round(key)
+
+
+	def __iter__(self):
+		yield from dict.__iter__(self)
+		yield from range(1, self['rounds'] + 1)
+
+
+	def __len__(self):
+		return dict.__len__(self) + self['rounds']
+
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+
+	def keys(self):
+		return KeysView(self)
+
+
+	def items(self):
+		return ItemsView(self)
+
+
+	def values(self):
+		return ValuesView(self)
+
+
+	def __reduce__(self):
+		# copies and pickles keep the stored keys only, as the rounds are rebuilt from the trick log
+		return GameRecord, (self['players'],), self.__dict__, None, iter(dict.items(self))
+
+
+	def round_info(self, n):
+		"""
+		A method which returns the players order, cards and tricks, table and table suit of round n
+		"""
+		players = self['players']
+		hands = self['deal'].copy()
+		tricks = {player: [] for player in players}
+		for leader, *table, winner, _ in self['tricks'][:n]:
+			for i, card in enumerate(table):
+				hands[(leader + i) % 4, card] = False
+			for i, player in enumerate(players):
+				tricks[player].append(int(i == winner))
+
+		info = {}
+		info['players_order'] = [players[(leader + i) % 4] for i in range(4)]
+		info['players_cards'] = {player: CardView(hands[i]).cards() for i, player in enumerate(players)}
+		info['players_tricks'] = tricks
+		info['table'] = CardView(table).cards()
+		info['table_suit'] = SUITS[self['tricks'][n - 1, 6] & 15]
+		return info
+
+
+# the keys of the info dict and the functions computing them, in order
+# keys whose function returns None are left out of the info of that step
+INFO_FIELDS = {
+	'round': lambda env: env.round,
+	'current_player': lambda env: env.current_player(),
+	'current_player_cards': lambda env: CardView(env.hands[env.current_player()]),
+	'player_order': lambda env: env.players,
+	'players_cards': lambda env: env.players_cards,
+	'players_bids': lambda env: env.bids,
+	'players_tricks': lambda env: env.tricks,
+	'table': lambda env: CardView(env.table),
+	'table_suit': lambda env: env.table_suit,
+	'trump_suit': lambda env: env.trump_suit,
+	'played_cards': lambda env: CardView(env.played),
+	'scores': lambda env: env.scores,
+	'last_call': lambda env: True if env.is_last_call() else None,
+	'illegal_call': lambda env: env.illegal_call(),
+	'legal_cards': lambda env: env.legal_cards(),
+	'legal_calls': lambda env: env.legal_calls(),
+	'legal_trumps': lambda env: ALL_TRUMPS.copy(),
+	'hand_features': lambda env: None if env.hand_features is None or env.phase_3 else {
+		name: values[env.seats[env.current_player()]] for name, values in env.hand_features.items()
+	},
+}
+
+# the info keys of agents acting from the current player and the legal action masks only
+INFO_KEYS = ['current_player', 'legal_cards', 'legal_calls', 'legal_trumps']
 
 
 class Estimation:
 	""" 
 	A class representing a game of estimation
 	"""
-	def __init__(self, state_func=change_state, players=list('ABCD')):
+	def __init__(self, state_func=change_state, players=list('ABCD'), incremental=False, recording=True, profile=False, info_fields=None, feature_cache=None):
 		self.state_func = state_func
-		self.players = players
+		self.players = players  # sets the seat players, led by the first
+		self.recording = recording  # keep a game record, which training runs can turn off
+
+		# the keys of the info dict, agents reading only some of them can skip computing the others
+		if info_fields is None:
+			info_fields = list(INFO_FIELDS)
+		unknown = set(info_fields) - set(INFO_FIELDS)
+		if unknown:
+			raise ValueError('unknown info fields {}, the fields are {}'.format(sorted(unknown), list(INFO_FIELDS)))
+		self.info_fields = [name for name in INFO_FIELDS if name in info_fields]
+
+		# the bidding features of the hands are computed at every deal when they're in the info or
+		# memoized by a HandFeatureCache, which can be shared by many environments
+		self.feature_cache = feature_cache
+		self.hand_features = None
+
+		# random generator of the deals and sampled actions, seeded by reset(seed=...)
+		self.rng = np.random.default_rng()
+
+		# time the sections of step when profile is True, and keep them as trace events when it's 'trace'
+		self.profiler = Profiler(trace=profile == 'trace') if profile else None
+
+		# keep every player's change_state observation up to date instead of rebuilding it each step
+		if incremental and state_func is not change_state:
+			raise ValueError('incremental observations are only available for change_state')
+		self.incremental = incremental
+
+		# seat-indexed game state reused by every reset, with per-player views of it
+		# seats number the players in their order when the game is dealt
+		self.seat_state = SeatState()
+		self.seats = {}
+		self.init_views()
+		self.table = []
+		self.played = []
+		self.record = None
+		self.incremental_state = None
+		self.observation_space = None
+		self.action_space = Action(self)
 
 
-	def reset(self):
-		# game record
-		self.record = {}
+	def init_views(self):
+		state = self.seat_state
+		self.hand_masks = state.hand_masks
+		self.void_masks = state.void_masks
+		self.hands = SeatRows(state, self.seats, state.hand_masks)
+		self.voids = SeatRows(state, self.seats, state.void_masks)
+		self.bids = Bids(state, self.seats)
+		self.tricks = Tricks(state, self.seats)
+		self.multi = Multipliers(state, self.seats)
 
-		# deck of cards
-		self.deck = Cards()
 
-		# players bids, tricks, score multipliers, scores and rewards
-		self.bids = defaultdict(list)
-		self.tricks = defaultdict(list)
-		self.multi = defaultdict(list)
+	def reset(self, seed=None, deal=None, leader=None):
+		"""
+		A method which deals a new game and returns the first observation and info
+
+		seed (an int or a np.random.SeedSequence) reseeds the random generator, so a game
+		played with the same seed and actions is dealt and sampled identically. deal is an
+		optional permutation of the 52 card tokens to deal instead of a shuffled deck, e.g.
+		a row of a deal corpus from deals.py. Given the seat of a leader to bid first, the
+		players keep the seats of the last game
+		"""
+		if seed is not None:
+			self.rng = np.random.default_rng(seed)
+
+		# the players take their seats in the order the last game ended in, unless a leader is given
+		if leader is None:
+			self.seat_players = self.players
+		self.leader = 0 if leader is None else leader
+
+		# game record, emptied in place once the environment has one
+		if not self.recording:
+			self.record = None
+		elif self.record is None:
+			self.record = GameRecord(self.seat_players)
+		else:
+			self.record.reset(self.seat_players)
+
+		# deck of cards
+		self.deck = DECK
+
+		# players hands, suits they're known to be void in, bids, tricks and score multipliers,
+		# zeroed in their seat arrays and viewed by player in self.hands, self.voids, self.bids,
+		# self.tricks and self.multi, and scores and rewards
+		self.seat_state.reset()
+		self.seats.clear()
+		self.seats.update(zip(self.seat_players, range(4)))
 		self.scores = defaultdict(int)
 		self.rewards = defaultdict(int)
 
-		# each player's cards, table cards, previously played cards and total called tricks
-		self.players_cards = defaultdict(list)
-		self.table = []
-		self.played = []
+		# table and previously played card tokens and total called tricks
+		self.table.clear()
+		self.played.clear()
 		self.total_tricks = 0
 
-
-		# table suit and trump suit
-		self.table_suit = ''
-		self.trump_suit = ''
+		# table suit and trump suit tokens
+		self.table_suit_token = NO_SUIT
+		self.trump_suit_token = NO_SUIT
 
 		# current player order, and round no.
 		self.order = 0
 		self.round = 0
 		
-		# initialize observation and action space
-		self.observation_space = Observation(self, self.state_func)
-		self.action_space = Action(self)
+		# initialize the observation space once, and the incremental observations zeroed by every game
+		if not self.incremental:
+			self.incremental_state = None
+		elif self.incremental_state is None or set(self.incremental_state.states) != set(self.seat_players):
+			self.incremental_state = IncrementalState(self)
+		else:
+			self.incremental_state.reset()
+		if self.observation_space is None:
+			self.observation_space = Observation(self, self.state_func)
 
 
 		# done flag, phase 1 flag, phase 2 flag and phase 3 flag
@@ -72,7 +584,7 @@ class Estimation:
 		self.dash_players = []
 
 		# deal cards to players
-		self.deal_to_players()
+		self.deal_to_players(deal)
 
 		# first player observation state
 		self.state = self.observation_space.next()
@@ -88,6 +600,10 @@ class Estimation:
 		2. an estimation of tricks
 		3. a trump suit
 		"""
+		profiler = self.profiler
+		if profiler:
+			phase = 'bidding' if self.phase_1 else 'calling' if self.phase_2 else 'playing'
+			start = profiler.clock()
 
 		# Phase 1
 		if self.phase_1:
@@ -102,17 +618,14 @@ class Estimation:
 			
 			else:  # if the bidding phase is over
 				self.select_highest_bid()
-				self.record['bids'] = self.bids
+				if self.recording:
+					# a copy, as the bids are views of the seat arrays every reset zeroes
+					self.record['bids'] = dict(self.bids)
 
 				# update flags
 				self.phase_1 = False
 				self.phase_2 = True
 
-			self.state = self.observation_space.next()
-			info = self.update_info()
-
-			return self.state, self.rewards, self.done, info
-
 		# Phase 2
 		elif self.phase_2:
 			# determine current player
@@ -133,10 +646,8 @@ class Estimation:
 				self.phase_2 = False
 				self.phase_3 = True
 
-			self.state = self.observation_space.next()
-			info = self.update_info()
-
-			return self.state, self.rewards, self.done, info
+			if self.recording:
+				self.record['bids'] = dict(self.bids)
 
 		# Phase 3
 		elif self.phase_3:
@@ -149,23 +660,160 @@ class Estimation:
 				winner = self.evaulate_winner()
 
 				self.assign_tricks(winner)
-				self.update_record()
+				if profiler:
+					updated = profiler.clock()
+				self.update_record(winner)
+				if profiler:
+					updated = profiler.add('record', updated)
 				self.reorder_players(winner)
 				self.empty_table()
+				if profiler:
+					updated = profiler.clock()
 				self.rewards = calculate_rewards(self)
+				if profiler:
+					profiler.add('rewards', updated)
 
 			if self.round == 13:
 				self.done = True
 				self.post_game_multi()
 				self.scores = self.update_scores()
-				self.record['scores'] = self.scores  # add the final score the game record
+				if self.recording:
+					self.record['scores'] = self.scores  # add the final score the game record
+
+		if profiler:
+			start = profiler.add(phase, start)
+		self.state = self.observation_space.next()
+		if profiler:
+			start = profiler.add('observation', start)
+		info = self.update_info()
+		if profiler:
+			profiler.add('update_info', start)
+
+		return self.state, self.rewards, self.done, info
 
-			self.state = self.observation_space.next()
-			info = self.update_info()
 
-			return self.state, self.rewards, self.done, info 
+	def match(self, deals, policy=None, seed=None):
+		"""
+		A generator method which plays a match of deals back to back, yielding the result of each
+
+		deals is a number of deals to shuffle or an iterable of deals, e.g. rows of a deal corpus.
+		The players keep their seats for the whole match, and the seat bidding first moves one
+		seat on every deal. policy(obs, info) returns the action of the current player, sampled
+		from the legal actions by default. The running totals are added up in self.match_scores
+		by seat, and each deal yields a dict of its number, first bidder, scores and totals by player
+		"""
+		deals = range(deals) if isinstance(deals, int) else deals
+		self.match_scores = np.zeros(4)
+		if seed is not None:
+			self.rng = np.random.default_rng(seed)
+
+		for i, deal in enumerate(deals):
+			# the first deal seats the players, who bid first in turn from then on
+			leader = i % 4 if i else None
+			obs, info = self.reset(deal=None if isinstance(deal, int) else deal, leader=leader)
+			done = False
+			while not done:
+				action = self.action_space.sample() if policy is None else policy(obs, info)
+				obs, _, done, info = self.step(action)
+
+			for seat, player in enumerate(self.seat_players):
+				self.match_scores[seat] += self.scores[player]
+			yield {
+				'deal': i,
+				'leader': self.seat_players[i % 4],
+				'scores': {player: self.scores[player] for player in self.seat_players},
+				'totals': dict(zip(self.seat_players, self.match_scores.tolist())),
+			}
+
+
+	def stats(self):
+		"""
+		A method which returns the calls, total seconds and mean microseconds per call of each profiled
+		section of step: the bidding, calling and playing phases (including their record and reward
+		updates), the observation function and update_info
+		"""
+		return self.profiler.stats() if self.profiler else {}
+
+
+	def export_trace(self, path):
+		"""
+		A method which writes the profiled sections to a Chrome trace JSON file, for an environment
+		created with profile='trace'
+		"""
+		if not self.profiler:
+			raise ValueError('profiling is off, create the environment with profile=\'trace\'')
+		self.profiler.export_trace(path)
 
 
+	def snapshot(self):
+		"""
+		A method which returns the mutable game state as a tuple, to be restored with restore
+		"""
+		return (
+			self.seat_state.snapshot(), self.leader, self.table[:], self.played[:],
+			dict(self.scores), self.rewards, self.state, self.dash_players[:],
+			self.total_tricks, self.table_suit_token, self.trump_suit_token, self.order, self.round,
+			self.done, self.phase_1, self.phase_2, self.phase_3, self.dash,
+			getattr(self, 'highest_bid', None), getattr(self, 'last_player', None), getattr(self, 'dash_skip', None),
+			self.record.snapshot() if self.recording else None,
+			self.incremental_state.snapshot() if self.incremental_state else None,
+			self.hand_features,
+		)
+
+	def restore(self, snapshot):
+		"""
+		A method which restores the game state of a snapshot
+		"""
+		(seat_state, self.leader, table, played, scores, self.rewards, self.state, dash_players,
+			self.total_tricks, self.table_suit_token, self.trump_suit_token, self.order, self.round,
+			self.done, self.phase_1, self.phase_2, self.phase_3, self.dash,
+			self.highest_bid, self.last_player, self.dash_skip, record, incremental, self.hand_features) = snapshot
+
+		# the seat arrays, table and played cards are restored in place as they may be referenced elsewhere
+		self.seat_state.restore(seat_state)
+		self.table[:] = table
+		self.played[:] = played
+		self.dash_players = dash_players[:]
+		self.scores = defaultdict(int, scores)
+
+		if self.recording:
+			self.record.restore(record, self)
+		if self.incremental_state:
+			self.incremental_state.restore(incremental)
+
+	def clone(self):
+		"""
+		A method which returns a new Estimation instance in the same game state, sharing no mutable state
+		"""
+		env = Estimation.__new__(Estimation)
+		env.state_func = self.state_func
+		env.seat_players = self.seat_players[:]
+		env.recording = self.recording
+		env.incremental = self.incremental
+		env.profiler = None  # clones made for search aren't profiled
+		env.info_fields = self.info_fields
+		env.feature_cache = self.feature_cache
+		env.rng = self.rng  # draws of a seeded search stay reproducible through the shared generator
+		env.deck = self.deck
+		env.seat_state = SeatState()
+		env.seats = dict(self.seats)
+		env.init_views()
+		env.table = []
+		env.played = []
+		env.record = GameRecord(self.record['players']) if self.recording else None
+		env.incremental_state = IncrementalState(env, list(self.incremental_state.states)) if self.incremental else None
+		env.observation_space = copy.copy(self.observation_space)
+		env.observation_space.env = env
+		env.action_space = Action(env)
+		env.restore(self.snapshot())
+		return env
+
+	def __setstate__(self, state):
+		# the masks and the per-player mappings are views of the seat arrays, which unpickling doesn't keep
+		self.__dict__.update(state)
+		if 'seat_state' in state:
+			self.init_views()
+
 	def select_highest_bid(self):
 		"""
 		A method which determines the highest bidding player and reorder the players accordingly
@@ -173,17 +821,18 @@ class Estimation:
 		max_trump = 0
 		max_est = 0
 		
-		# loop over players bids
-		for player, bid in self.bids.items():
+		# loop over players bids in the order they bid, so ties go to the earlier bid
+		for player in self.players:
+			bid = self.bids[player]
 			# if a player dashed
 			if bid[0] == 0:
 				# if this was the first player to dash
 				if not self.dash:
-					self.multi[player].append('dash')
+					self.multi.add(player, 'dash')
 					self.dash = True  # initialize a dash flag 
 					self.dash_players = list(player)
 				elif self.dash and len(self.dash_players) < 2:
-					self.multi[player].append('dash')
+					self.multi.add(player, 'dash')
 					self.dash_players.append(player)
 
 			# if the player estimation exceeded the max one
@@ -200,11 +849,12 @@ class Estimation:
 					highest_player = player
 			
 
-		self.multi[highest_player].append('bidder')  # append bidder multiplier for score calculation
+		self.multi.add(highest_player, 'bidder')  # append bidder multiplier for score calculation
 		self.bids[highest_player] = max_est  # change the bid value to contain only the estimated tricks
 		self.highest_bid = max_est
-		self.trump_suit = self.deck.suits[max_trump]  # set the trump suit
-		self.record['trump_suit'] = self.deck.suits[max_trump]
+		self.trump_suit_token = max_trump  # set the trump suit
+		if self.recording:
+			self.record['trump_suit'] = SUITS[max_trump]
 		self.total_tricks += max_est
 
 		# reorder players and reintialize other players' bids for phase 2
@@ -216,7 +866,7 @@ class Estimation:
 		# reinitialize order to start phase 2
 		if self.dash:
 			if len(self.dash_players) == 1:
-				dash_player_order = self.players.index(self.dash_players[0])
+				dash_player_order = self.order_of(self.dash_players[0])
 				if dash_player_order == 1:
 					self.order = 2
 					self.dash_skip = 1
@@ -229,18 +879,22 @@ class Estimation:
 					self.last_player = 2
 					self.dash_skip = 3
 			else:
-				dash_players_order = set([self.players.index(player) for player in self.dash_players])
+				dash_players_order = set([self.order_of(player) for player in self.dash_players])
 				players_order = set([1, 2, 3])
 				self.last_player = players_order.difference(dash_players_order).pop()
 				self.order = self.last_player
 
+		if self.incremental_state:
+			self.incremental_state.set_bids()
+
 	def reorder_players(self, winner):
 		"""
-		A method which reorder players according to the round winner
+		A method which reorder players according to the round winner, who leads the next round
 		"""
-		winner_order = self.players.index(winner)
-		for _ in range(winner_order):
-			self.players.insert(3, self.players.pop(0))
+		self.leader = self.seats[winner]
+
+		if self.incremental_state:
+			self.incremental_state.seat()
 
 
 
@@ -249,19 +903,30 @@ class Estimation:
 		"""
 		A method which reinitializes bid for players who didn't win in the bidding phase
 		"""
-		for player in self.players:
+		for player in self.seat_players:
 			if player is not highest_player:
 				self.bids[player] = 0
 
 
-	def deal_to_players(self):
-		# shuffle the deck
-		self.deck.shuffle()
+	def deal_to_players(self, deal=None):
+		# shuffle the deck, unless a deal is given
+		if deal is None:
+			deal = self.rng.permutation(52)
+
+		# give each player 13 cards, one at a time from the end of the deck
+		self.hand_masks[DEAL_SEATS, deal] = True
+
+		# bidding features of the four hands by seat
+		if self.feature_cache is not None:
+			self.hand_features = self.feature_cache(self.hand_masks)
+		elif 'hand_features' in self.info_fields:
+			self.hand_features = hand_features(self.hand_masks)
 
-		# give each player 13 cards
-		for _ in range(13):
-			for player in self.players:
-				self.players_cards[player].append(self.deck.cards.pop())
+		if self.recording:
+			self.record.deal[:] = self.hand_masks
+
+		if self.incremental_state:
+			self.incremental_state.deal()
 
 	def update_info(self):
 		"""
@@ -277,59 +942,122 @@ class Estimation:
 			9. trump_suit
 			8. played_cards: a list of played cards
 			9. scores
+			10. legal_cards, legal_calls and legal_trumps: boolean masks of the legal actions
+			11. hand_features: the bidding features of the current player's hand during the bidding
+				and calling phases, see functions.hand_features
 
 			In case this was the last player's call, a flag will be included with a illegal estimation number
+
+		Only the keys of info_fields are computed when the environment was created with them
 		"""
 		info = {}
-		info['round'] = self.round
-		info['current_player'] = self.current_player()
-		info['current_player_cards'] = self.players_cards[self.current_player()]
-		info['player_order'] = self.players
-		info['players_cards'] = self.players_cards
-		info['players_bids'] = self.bids
-		info['players_tricks'] = self.tricks
-		info['table'] = self.table
-		info['table_suit'] = self.table_suit
-		info['trump_suit'] = self.trump_suit
-		info['played_cards'] = self.played
-		info['scores'] = self.scores
-
-		if self.phase_2 and self.current_player() is self.last_player:
-			info['last_call'] = True
-			info['illegal_call'] = 13 - self.total_tricks
-
-
-		if self.phase_1:
-			bids = [bid[0] for bid in self.bids.values() if bid]
-			if Counter(bids)[0] > 1:
-				info['illegal_call'] = 0
+		for name in self.info_fields:
+			value = INFO_FIELDS[name](self)
+			if value is not None:
+				info[name] = value
 
 		return info
 
-	def update_record(self):
+	def update_record(self, winner):
 		"""
-		A method which update the record dict of the game with info about recent round
+		A method which appends the recent round to the trick log of the game record
 		"""
-		info = {}
-		info['players_order'] = copy.deepcopy(self.players)
-		info['players_cards'] = copy.deepcopy(self.players_cards)
-		info['players_tricks'] = copy.deepcopy(self.tricks)
-		info['table'] = copy.deepcopy(self.table)
-		info['table_suit'] = copy.deepcopy(self.table_suit)
-
-		self.record[self.round] = info
+		if self.recording:
+			self.record.log_trick(self.seat_players[self.leader], self.table, winner, self.trump_suit_token, self.table_suit_token)
 
 	def current_player(self):
 		"""
 		A method to determine the current player
 		"""
-		return self.players[self.order]
+		return self.seat_players[(self.leader + self.order) % 4]
+
+	def order_of(self, player):
+		"""
+		A method which returns the position of a player in the current order, the leader being 0
+		"""
+		return (self.seats[player] - self.leader) % 4
+
+	@property
+	def players(self):
+		"""
+		The players in their current order, starting from the leader
+		"""
+		return self.seat_players[self.leader:] + self.seat_players[:self.leader]
+
+	@players.setter
+	def players(self, players):
+		self.seat_players = list(players)
+		self.leader = 0
+
+	@property
+	def players_cards(self):
+		"""
+		The players' hands as lists of (rank, suit) cards, built from the hand masks
+		"""
+		return PlayersCards(self.hands)
+
+	@property
+	def table_suit(self):
+		return SUITS[self.table_suit_token] if self.table_suit_token != NO_SUIT else ''
+
+	@property
+	def trump_suit(self):
+		return SUITS[self.trump_suit_token] if self.trump_suit_token != NO_SUIT else ''
+
+	def is_last_call(self):
+		"""
+		A method which checks whether the current player makes the last call of phase 2
+		"""
+		return self.phase_2 and self.order == self.last_player
+
+	def illegal_call(self):
+		"""
+		A method which returns the estimation the current player isn't allowed to call, or None
+			1. a third dash call in phase 1
+			2. the last call making the total tricks 13 in phase 2
+		"""
+		# two dashes need two bids, which the order of the bidding phase counts
+		state = self.seat_state
+		if self.phase_1 and self.order > 1 and np.count_nonzero(state.bid_made & (state.estimates == 0)) > 1:
+			return 0
+		if self.is_last_call():
+			return 13 - self.total_tricks
+
+	def legal_actions(self):
+		"""
+		A method which returns a dict of boolean masks of the current player's legal cards (52),
+		calls (14) and trump suits (4)
+		"""
+		return {'legal_cards': self.legal_cards(), 'legal_calls': self.legal_calls(), 'legal_trumps': ALL_TRUMPS.copy()}
+
+	def legal_calls(self):
+		"""
+		A method which returns a mask of the estimations the current player is allowed to call
+		"""
+		calls = ALL_CALLS.copy()
+		illegal_call = self.illegal_call()
+		if illegal_call is not None and 0 <= illegal_call < 14:
+			calls[illegal_call] = False
+		return calls
+
+	def legal_cards(self):
+		"""
+		A method which returns a mask of the current player's cards which follow the table suit,
+		or of all of them if none does
+		"""
+		hand = self.hands[self.current_player()]
+		if self.table_suit_token == NO_SUIT:
+			return hand
+		follow = hand & SUIT_CARDS[self.table_suit_token]
+		return follow if follow.any() else hand
 
 	def bid(self, player, action):
 		"""
 		A method to add bid for a player in phase 1
 		"""
-		self.bids[player].extend(action[1:])
+		seat = self.seats[player]
+		self.seat_state.estimates[seat], self.seat_state.bid_trumps[seat] = action[1], action[2]
+		self.seat_state.bid_made[seat] = True
 
 	def call(self, player, action, last_player=False):
 		"""
@@ -338,97 +1066,110 @@ class Estimation:
 		call = action[1]
 		if not last_player:
 			if call == self.highest_bid:
-				self.multi[player].append('with')
+				self.multi.add(player, 'with')
 		else:
 			if call == self.highest_bid:
 				if call + self.total_tricks == 15:
-					self.multi[player].append('withrisk')
+					self.multi.add(player, 'withrisk')
 				elif call + self.total_tricks > 15:
-			 		self.multi[player].append('withdoublerisk')
+					self.multi.add(player, 'withdoublerisk')
 				else:
-			  		self.multi[player].append('with')
+					self.multi.add(player, 'with')
 
 			elif call != 0:
 				if call + self.total_tricks == 15:
-					self.multi[player].append('risk')
+					self.multi.add(player, 'risk')
 				elif call + self.total_tricks > 15:
-					self.multi[player].append('doublerisk')
+					self.multi.add(player, 'doublerisk')
 				else:
-					self.multi[player].append('regular')
+					self.multi.add(player, 'regular')
 
 		if call == 0:
-			self.multi[player].append('nocall')
+			self.multi.add(player, 'nocall')
 
 		elif call >= 8:
-			self.multi[player].append('>=8')
+			self.multi.add(player, '>=8')
 
 		self.bids[player] = call
 		self.total_tricks += call
 
+		if self.incremental_state:
+			self.incremental_state.set_bid(player, call)
+
 	def play_card(self, player, action):
 		"""
 		A method to player a card through a given action
 		"""
-		hand = self.players_cards[player]
-		card_token = action[0]  
-		card = self.deck.token_to_card[card_token]
-		card_index =  hand.index(card)  # index of the card in players hand
-		self.table.append(hand.pop(card_index))  # add the card to the table
+		hand = self.hands[player]
+		card_token = int(action[0])
+		if not hand[card_token]:
+			raise ValueError('card {} is not in the hand of player {}'.format(CARDS[card_token], player))
+		hand[card_token] = False
+
+		# a player who doesn't follow the table suit has none of it left
+		if self.table and card_token // 13 != self.table_suit_token:
+			self.voids[player][self.table_suit_token] = True
+		self.table.append(card_token)  # add the card to the table
+
+		if self.incremental_state:
+			self.incremental_state.place(card_token, 2)
 		
 		# declare table suit if it was the first card on the table
 		if len(self.table) == 1:
-			self.table_suit = card[1]
+			self.table_suit_token = card_token // 13
 
 	def evaulate_winner(self):
 		"""
 		A method to evaluate winner
 		"""
-		if self.check_trump():
-			# filter the cards to only include trump cards if a trump card was played
-		    cards = [self.deck.card_to_token[card] if card[-1] == self.trump_suit else 0 for card in self.table]
-		else:
-			# filter the cards to only include cards of the table suit
-		    cards = [self.deck.card_to_token[card] if card[-1] == self.table_suit else 0 for card in self.table]
+		# strengths of the table cards given the trump and table suits, see functions.strength_table
+		row = STRENGTH_ROWS[self.trump_suit_token][self.table_suit_token]
+		strengths = [row[token] for token in self.table]
+		best = max(strengths)
+		position = 0 if best == TWO_OF_CLUBS_TRUMP else strengths.index(best)
 
 		# returns the player with the highest card value
-		return self.players[np.argmax(cards)]
+		return self.seat_players[(self.leader + position) % 4]
 
 	def check_trump(self):
 		"""
 		A method to check whether the table cards contain trump cards
 		"""
-		suits = [card[-1] for card in self.table]
-		if self.trump_suit in suits:
-		    return True
-		else:
-		    return False
+		suits = [token // 13 for token in self.table]
+		return self.trump_suit_token in suits
 
 	def assign_tricks(self, winner):
 		"""
 		A method which assigns tricks after a succesful round
 		"""
-		for player in self.players:
-			if player is winner:
-				self.tricks[player].append(1)
-			else:
-				self.tricks[player].append(0)
+		state = self.seat_state
+		seat = self.seats[winner]
+		state.won[seat, state.n_tricks] = 1
+		state.won_counts[seat] += 1
+		state.n_tricks += 1
+
+		if self.incremental_state:
+			self.incremental_state.add_trick(winner)
 
 	def empty_table(self):
 		"""
 		A method which empties a table after a mini round and resets table suit
 		"""
 		for _ in range(4):
-			self.played.append(self.table.pop())
+			card_token = self.table.pop()
+			self.played.append(card_token)
+			if self.incremental_state:
+				self.incremental_state.place(card_token, 3)
 
-		self.table_suit = ''
+		self.table_suit_token = NO_SUIT
 
 	def post_game_multi(self):
 		"""
 		A method which for post game score multiplier determination
 		"""
 		outcomes = {}
-		for player in self.players:
-			if self.bids[player] == sum(self.tricks[player]):
+		for player in self.seat_players:
+			if self.bids[player] == self.seat_state.won_counts[self.seats[player]]:
 				outcomes[player] = 1
 			else:
 				outcomes[player] = 0
@@ -436,99 +1177,30 @@ class Estimation:
 		if wins == 1:
 			for player, outcome in outcomes.items():
 				if outcome == 1:
-					self.multi[player].append('onlywin')
+					self.multi.add(player, 'onlywin')
 			if wins == 3:
 				for player, outcome in outcomes.items():
 					if outcome == 0:
-						self.multi[player].append('onlylose')
+						self.multi.add(player, 'onlylose')
 
 	def update_scores(self, reward=False):
 		"""
-		A method which updates scores after the end of the game according to tricks and multipliers
-    	"""
-
-		X = np.zeros(4)  # main points
-		Y = np.zeros(4)  # extra points
-		Z = np.ones(4)  # bidding multipliers
-		won = False
+		A method which updates scores after the end of the game according to tricks and multipliers,
+		looked up in the score table by multiplier bits, estimated and actual tricks
+		"""
 		scores = defaultdict()
-		tricks = self.bids if reward else self.tricks
-
-		for i, player in enumerate(self.players):  # Main points
-			player_estimated = self.bids[player]
-			player_actual = sum(tricks[player]) if not reward else tricks[player]
-			if player_actual == player_estimated:
-				X[i] += player_estimated
-				won = True
-			else:
-				X[i] -= abs(player_estimated - player_actual)
-				won = False
-
-			if 'bidder' in self.multi[player]:
-				if won:
-					Y[i] += 20
-				else:
-					Y[i] -= 10
-
-			if 'dash' in self.multi[player]:
-				if won:
-					Y[i] += 23
-				else:
-					Y[i] -= 23
-
-			if 'regular' in self.multi[player]:
-				if won:
-					Y[i] += 10
-
-			if 'risk' in self.multi[player]:
-				if won:
-					Y[i] += 20
-				else:
-					Y[i] -= 10
-
-			if 'doublerisk' in self.multi[player]:
-				if won:
-					Y[i] += 30
-				else:
-					Y[i] -= 20
-
-			if 'with' in self.multi[player]:
-				if won:
-					Y[i] += 20
-				else:
-					Y[i] -= 10
-
-			if 'withrisk' in self.multi[player]:
-				if won:
-					self.scores[i] += 30
-				else:
-					self.scores[i] -= 20
-
-			if 'withdoublerisk' in self.multi[player]:
-				if won:
-					Y[i] += 40
-				else:
-					Y[i] -= 30
-
-			if 'onlywin' in self.multi[player]:
-				Y[i] += 10
-
-			if 'onlylose' in self.multi[player]:
-				Y[i] -= 10
-
-			if 'nocall' in self.multi[player]:
-				if won:
-					Y[i] += 10
-				else:
-					Y[i] -= 10
-
-			if '>=8' in self.multi[player]:
-				Z[i] = 2
+		state = self.seat_state
+		for i, player in enumerate(self.players):
+			seat = self.seats[player]
+			multi = state.multi[seat]
+			estimated = state.estimates[seat]
+			actual = estimated if reward else state.won_counts[seat]
+			scores[player] = float(SCORES[multi, estimated, actual])
+
+			# the withrisk points are added to the running scores by seat number rather than to the score
+			if multi & WITHRISK:
+				self.scores[i] += 30 if actual == estimated else -20
 
-		scores_arr = (X + Y) * Z + (X + Y) * (Z - 1)
-		for i, score in enumerate(scores_arr):
-			player = self.players[i]
-			scores[player] = score
 		return scores
 
 
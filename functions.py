@@ -1,5 +1,212 @@
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+
+# cards are tokens 0..51, the suit of a token being token // 13 and its rank token % 13
+SUITS = ['C', 'D', 'H', 'S']
+RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+CARDS = [(rank, suit) for suit in SUITS for rank in RANKS]
+CARD_TO_TOKEN = {card: token for token, card in enumerate(CARDS)}
+
+# suit token of no suit, and the cards of each suit token, the row of no suit being empty
+NO_SUIT = 4
+SUIT_CARDS = np.arange(52) // 13 == np.arange(5)[:, None]
+
+# score multiplier bits, one per multiplier name of Estimation.multi
+BIDDER = 1 << 0
+DASH = 1 << 1
+REGULAR = 1 << 2
+RISK = 1 << 3
+DOUBLERISK = 1 << 4
+WITH = 1 << 5
+WITHRISK = 1 << 6
+WITHDOUBLERISK = 1 << 7
+ONLYWIN = 1 << 8
+ONLYLOSE = 1 << 9
+NOCALL = 1 << 10
+GE8 = 1 << 11
+
+# score multiplier bits of the multiplier names
+MULTI_BITS = {
+	'bidder': BIDDER, 'dash': DASH, 'regular': REGULAR, 'risk': RISK, 'doublerisk': DOUBLERISK,
+	'with': WITH, 'withrisk': WITHRISK, 'withdoublerisk': WITHDOUBLERISK, 'onlywin': ONLYWIN,
+	'onlylose': ONLYLOSE, 'nocall': NOCALL, '>=8': GE8,
+}
+
+# multiplier bit, points when the estimation is met and points when it isn't
+# withrisk is left out as its points go to the running scores instead, see Estimation.update_scores
+MULTI_POINTS = [
+	(BIDDER, 20, -10),
+	(DASH, 23, -23),
+	(REGULAR, 10, 0),
+	(RISK, 20, -10),
+	(DOUBLERISK, 30, -20),
+	(WITH, 20, -10),
+	(WITHDOUBLERISK, 40, -30),
+	(ONLYWIN, 10, 10),
+	(ONLYLOSE, -10, -10),
+	(NOCALL, 10, -10),
+]
+
+# extra points of every combination of multiplier bits
+WIN_POINTS = np.zeros(GE8 << 1)
+LOSE_POINTS = np.zeros(GE8 << 1)
+for bit, win, lose in MULTI_POINTS:
+	WIN_POINTS[np.arange(GE8 << 1) & bit > 0] += win
+	LOSE_POINTS[np.arange(GE8 << 1) & bit > 0] += lose
+
+
+def score_table():
+	"""
+	A function which returns the score of every (multiplier bits, estimated, actual tricks)
+	"""
+	multi = np.arange(GE8 << 1)[:, None, None]
+	estimated = np.arange(14)[:, None]
+	actual = np.arange(14)
+	won = estimated == actual
+
+	X = np.where(won, estimated, -np.abs(estimated - actual))  # main points
+	Y = np.where(won, WIN_POINTS[multi], LOSE_POINTS[multi])  # extra points
+	Z = np.where(multi & GE8, 2, 1)  # bidding multipliers
+
+	return ((X + Y) * Z + (X + Y) * (Z - 1)).astype(np.int16)
+
+# scores indexed by multiplier bits, estimated and actual tricks
+SCORES = score_table()
+
+
+def strength_table():
+	"""
+	A function which returns the strength of every card by trump suit token (NO_SUIT before there
+	is one) and table suit token, the strongest card of a trick taking it as in
+	Estimation.evaulate_winner: trumps beat cards of the table suit, which beat the other cards
+	worth 0, each by rank. The two of clubs is the weakest trump, see TWO_OF_CLUBS_TRUMP
+	"""
+	suits = np.arange(52) // 13
+	ranks = np.arange(52) % 13
+	trumps = np.arange(5)[:, None, None]
+	table_suits = np.arange(4)[:, None]
+	strengths = np.where(suits == trumps, 15 + ranks, np.where(suits == table_suits, 1 + ranks, 0))
+	strengths[0, :, 0] = TWO_OF_CLUBS_TRUMP
+	return strengths.astype(np.int8)
+
+# strength of the two of clubs as a trump, its token being 0 it's worth nothing in evaulate_winner,
+# so when it's the strongest card of a trick, i.e. the only trump, the leader takes the trick
+TWO_OF_CLUBS_TRUMP = 14
+
+# card strengths indexed by trump suit token, table suit token and card token, and as nested lists
+STRENGTHS = strength_table()
+STRENGTH_ROWS = STRENGTHS.tolist()
+
+
+def trick_winners(tables, trumps):
+	"""
+	A function which returns the position of the winning card of a table of card tokens in the
+	order they were played, or of an (n, 4) batch of tables, given their trump suit tokens
+	"""
+	tables = np.asarray(tables)
+	strengths = STRENGTHS[np.asarray(trumps)[..., None], tables[..., :1] // 13, tables]
+	return np.where(strengths.max(axis=-1) == TWO_OF_CLUBS_TRUMP, 0, strengths.argmax(axis=-1))
+
+
+def multi_names(bits):
+	"""
+	A function which returns the multiplier names of multiplier bits
+	"""
+	return [name for name, bit in MULTI_BITS.items() if bits & bit]
+
+
+# bit of each rank in the bitmask of the cards of a suit
+RANK_BITS = 1 << np.arange(13, dtype=np.int64)
+
+
+def suit_features():
+	"""
+	A function which returns the length, high card points, quick tricks and tricks as trumps of
+	every bitmask of the cards of a suit
+	"""
+	cards = (np.arange(1 << 13)[:, None] & RANK_BITS) > 0
+	lengths = cards.sum(axis=1)
+	ace, king, queen = cards[:, 12], cards[:, 11], cards[:, 10]
+	hcp = cards[:, 9:] @ np.arange(1, 5)
+	quick = np.select(
+		[ace & king, ace & queen, ace, king & queen, king & (lengths > 1)],
+		[2, 1.5, 1, 1, 0.5], 0,
+	)
+	trumps = np.minimum(lengths, cards[:, 10:].sum(axis=1) + np.maximum(lengths - 3, 0))
+	return lengths.astype(np.int8), hcp.astype(np.int8), quick.astype(np.float32), trumps.astype(np.float32)
+
+# features indexed by the bitmask of the cards of a suit
+SUIT_LENGTHS, SUIT_HCP, QUICK_TRICKS, TRUMP_TRICKS = suit_features()
+
+
+def hand_features(hands):
+	"""
+	A function which returns the bidding features of boolean hands of shape (n, 52) as a dict of arrays:
+		suit_lengths (n, 4): the number of cards of each suit
+		hcp (n,): the high card points, 4 per ace, 3 per king, 2 per queen and 1 per jack
+		quick_tricks (n, 4): the tricks the top cards of each suit take in its first two rounds,
+			2 for AK, 1.5 for AQ, 1 for A or KQ and 0.5 for K with another card
+		winners (n, 4): the estimated tricks with each suit as trump, the quick tricks of the other
+			suits plus the ace, king and queen of trumps and every trump after the third
+	"""
+	suits = hands.reshape(-1, 4, 13) @ RANK_BITS
+	quick = QUICK_TRICKS[suits]
+	return {
+		'suit_lengths': SUIT_LENGTHS[suits],
+		'hcp': SUIT_HCP[suits].sum(axis=1, dtype=np.int8),
+		'quick_tricks': quick,
+		'winners': quick.sum(axis=1, keepdims=True) - quick + TRUMP_TRICKS[suits],
+	}
+
+
+class HandFeatureCache:
+	"""
+	A class which memoizes hand_features, a drop-in for it
+
+	Hands are keyed on the bitmasks of their suits sorted in descending order, so hands which are
+	the same up to a permutation of the suits share one entry, its features being permuted back
+	to the suits of each hand. The least recently used entries are evicted once it holds maxsize hands.
+	"""
+	def __init__(self, maxsize=1 << 16):
+		self.maxsize = maxsize
+		self.table = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+
+	def __call__(self, hands):
+		suits = hands.reshape(-1, 4, 13) @ RANK_BITS
+		order = np.argsort(-suits, axis=1, kind='stable')
+		canonical = np.take_along_axis(suits, order, axis=1)
+		keys = [((a << 13 | b) << 13 | c) << 13 | d for a, b, c, d in canonical.tolist()]
+
+		rows = [None] * len(keys)
+		for i, key in enumerate(keys):
+			if key in self.table:
+				self.table.move_to_end(key)
+				rows[i] = self.table[key]
+				self.hits += 1
+
+		# the features of the hands missing from the table are computed at once
+		missing = [i for i, row in enumerate(rows) if row is None]
+		if missing:
+			self.misses += len(missing)
+			hands = (canonical[missing, :, None] >> np.arange(13) & 1).astype(bool).reshape(-1, 52)
+			features = hand_features(hands)
+			for j, i in enumerate(missing):
+				rows[i] = self.table[keys[i]] = {name: values[j] for name, values in features.items()}
+				if len(self.table) > self.maxsize:
+					self.table.popitem(last=False)
+
+		# the features of the sorted suits go back to the suits of each hand
+		features = {}
+		for name in ('suit_lengths', 'quick_tricks', 'winners'):
+			values = np.stack([row[name] for row in rows])
+			features[name] = np.empty_like(values)
+			np.put_along_axis(features[name], order, values, axis=1)
+		features['hcp'] = np.array([row['hcp'] for row in rows])
+		return features
+
 
 def change_state(env):
     """
@@ -25,47 +232,32 @@ def change_state(env):
     """
 
     player = env.current_player()
-    player_cards = env.players_cards[player]
-    player_cards_tokens = [env.deck.card_to_token[card] for card in player_cards]
     state = np.zeros(65,)
-    for token in player_cards_tokens:
-        state[token] = 1
+    state[:52] = env.hands[player]
     # if there are cards on the table
     if env.table:
-        table_tokens = [env.deck.card_to_token[card] for card in env.table]
-        for token in table_tokens:
-            state[token] = 2
+        state[env.table] = 2
     # if there are played cards
     if env.played:
-        played_tokens = [env.deck.card_to_token[card] for card in env.played]
-        for token in played_tokens:
-            state[token] = 3
+        state[env.played] = 3
     
-    other_players = env.players[:]
-    other_players.remove(player)
-
-    # if players finished the first and/or the second phase
-    if env.bids:
-        state[52] = env.bids[player] if not isinstance(env.bids[player], list) else 0
-        for i, p in enumerate(other_players):
-            state[54+(i*2)] = env.bids[p] if not isinstance(env.bids[player], list) else 0
+    # seats of the player and of the other players in their order, counted from the leader's seat
+    seat_state = env.seat_state
+    seat = env.seats[player]
+    others = [(env.leader + i) % 4 for i in range(4) if i != env.order]
+
+    # if the player's bid is a call, once the bidder is selected
+    if seat_state.bid_made[seat] and seat_state.bid_trumps[seat] < 0:
+        state[52] = seat_state.estimates[seat]
+        state[54:60:2] = seat_state.estimates[others]
     # if players collected any tricks
-    if env.tricks:
-        state[53] = sum(env.tricks[player])
-        for i, p in enumerate(other_players):
-            state[55+(i*2)] = sum(env.tricks[p])
-
-    # if there is a table suit
-    if env.table_suit:
-        state[60] = env.deck.suits.index(env.table_suit)
-    else:
-        state[60] = 4
-    
-    # if there is a trump suit
-    if env.trump_suit:
-        state[61] = env.deck.suits.index(env.trump_suit)
-    else:
-        state[61] = 4
+    if seat_state.n_tricks:
+        state[53] = seat_state.won_counts[seat]
+        state[55:61:2] = seat_state.won_counts[others]
+
+    # table and trump suit tokens, 4 if there is no suit
+    state[60] = env.table_suit_token
+    state[61] = env.trump_suit_token
 
     # total asked tricks, round no. and current player order
     state[62] = env.total_tricks
@@ -77,28 +269,19 @@ def change_state(env):
 
 
 
-def filter_legal_cards(card_probs, env):
+def filter_legal_cards(card_probs, env, info=None):
 	"""
-	A function which filters out values of cards or probabilities to the legal ones only
+	A function which filters out values of cards or probabilities to the legal ones only,
+	using the legal cards mask of info when given
 	"""
-	player = env.current_player()
-	player_cards = env.players_cards[player]
-	if env.table_suit:
-		legal_cards = [card for card in player_cards if card[1] == env.table_suit]
-		if not legal_cards:
-			legal_cards = player_cards
-	else:
-		legal_cards = player_cards
+	legal_cards = info['legal_cards'] if info else env.legal_cards()
 
-
-	cards_tokens = [env.deck.card_to_token[card] for card in legal_cards]
-
-	# filter card probabilties by their presence in the legal card tokens
-	legal_card_probs = [prob if i in cards_tokens else 0 for i, prob in enumerate(card_probs)]
+	# filter card probabilties by the legal cards mask
+	legal_card_probs = np.where(legal_cards, np.asarray(card_probs, dtype=float)[:52], 0)
 
 	# in case the probability of the last card was zero
-	if sum(legal_card_probs) == 0:
-		left_card_token = env.deck.card_to_token[player_cards[0]]
+	if not legal_card_probs.any():
+		left_card_token = np.argmax(legal_cards)
 		legal_card_probs[left_card_token] = 1.0
 
 	return legal_card_probs
@@ -108,11 +291,7 @@ def filter_legal_calls(call_probs, info):
 	"""
 	A function which filters out legal calls
 	"""
-	if 'illegal_call' in info.keys():
-		call_probs = [prob if i != info['illegal_call'] else 0 for i, prob in enumerate(call_probs)]
-
-	
-	return call_probs
+	return np.where(info['legal_calls'], call_probs, 0)
 
 
 def process_action(action, env, info):
@@ -120,11 +299,43 @@ def process_action(action, env, info):
 	A function which filter out the legal actions
 	"""
 	card_probs, call_probs, trump_probs = action
-	legal_card_probs = filter_legal_cards(card_probs, env)
+	legal_card_probs = filter_legal_cards(card_probs, env, info)
 	legal_call_probs = filter_legal_calls(call_probs, info)
 	
 	return [legal_card_probs, legal_call_probs, trump_probs]
 
+
+# upper triangular ones, multiplying a mask by it counts the legal actions up to each action
+TRIU = np.triu(np.ones((52, 52), dtype=np.float32))
+
+# the info keys of the legal masks of the card, call and trump suit of an action
+LEGAL_KEYS = ['legal_cards', 'legal_calls', 'legal_trumps']
+
+
+def sample_actions(info, rng=np.random):
+	"""
+	A function which samples uniformly random legal actions from the legal masks of an info, an
+	action of 3 from the masks of one player or an (n, 3) array of them from stacked masks
+	"""
+	masks = [np.asarray(info[key], dtype=np.float32) for key in LEGAL_KEYS]
+	actions = np.empty(masks[0].shape[:-1] + (3,), dtype=np.int64)
+	for i, mask in enumerate(masks):
+		# pick the k-th legal action for a uniform k, counting legal actions with a matmul
+		counts = mask @ TRIU[:mask.shape[-1], :mask.shape[-1]]
+		k = np.floor(rng.random(mask.shape[:-1]) * counts[..., -1])
+		actions[..., i] = np.argmax(counts > k[..., None], axis=-1)
+	return actions
+
+
+def sample_legal(probs, mask, rng=np.random):
+	"""
+	A function which samples an action from probabilities restricted to the legal actions mask
+	"""
+	cumulative = np.cumsum(np.where(mask, probs, 0))
+	if cumulative[-1] <= 0:
+		return rng.choice(np.flatnonzero(mask))
+	return np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right')
+
 def norm(arr):
     arr = np.array(arr, dtype=float)
     return arr/sum(arr)
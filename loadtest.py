@@ -0,0 +1,75 @@
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from server import EstimationServer, EstimationClient
+from functions import LEGAL_KEYS, sample_actions
+
+
+async def load_test(tables=64, steps=20000, seed=0, host='127.0.0.1', port=None, path=None):
+	"""
+	A function which plays random games on a number of tables in lockstep, the actions of all tables
+	being sampled as one batch and their steps pipelined, and returns the games (tables played to
+	the end) and steps per second and the p50 and p99 step latencies in milliseconds. Without a
+	port or path, a server is started in the same process on a loopback port.
+	"""
+	server = None
+	if port is None and path is None:
+		server = await EstimationServer().start(host, 0)
+		port = server.sockets[0].getsockname()[1]
+	client = await EstimationClient.connect(host, port, path)
+
+	rng = np.random.default_rng(seed)
+	results = await asyncio.gather(*[client.reset(table, seed + table) for table in range(tables)])
+	infos = [info for _, info in results]
+	latencies, games, done_steps = [], 0, 0
+
+	async def timed_step(table, action):
+		start = time.perf_counter()
+		result = await client.step(table, action)
+		latencies.append(time.perf_counter() - start)
+		return result
+
+	start = time.perf_counter()
+	while done_steps < steps:
+		# the actions of all tables are sampled as one batch, standing in for a batched policy
+		actions = sample_actions({key: np.stack([info[key] for info in infos]) for key in LEGAL_KEYS}, rng)
+		results = await asyncio.gather(*[timed_step(table, actions[table]) for table in range(tables)])
+		done_steps += tables
+
+		resets = {}
+		for table, (_, _, done, info) in enumerate(results):
+			infos[table] = info
+			if done:
+				games += 1
+				resets[table] = client.reset(table)
+		for table, future in resets.items():
+			infos[table] = (await future)[1]
+	elapsed = time.perf_counter() - start
+
+	await client.close()
+	if server is not None:
+		server.close()
+		await server.wait_closed()
+
+	latencies = np.array(latencies) * 1e3
+	return {
+		'tables': tables,
+		'tables_per_second': games / elapsed,
+		'steps_per_second': done_steps / elapsed,
+		'p50_ms': float(np.percentile(latencies, 50)),
+		'p99_ms': float(np.percentile(latencies, 99)),
+	}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measure the throughput and step latency of an Estimation server')
+	parser.add_argument('--tables', type=int, default=64)
+	parser.add_argument('--steps', type=int, default=20000)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, help='server to connect to, one is started in process if neither --port nor --path is given')
+	parser.add_argument('--path', help='Unix domain socket of the server to connect to')
+	args = parser.parse_args()
+	print(json.dumps(asyncio.run(load_test(args.tables, args.steps, args.seed, args.host, args.port, args.path)), indent=2))
@@ -0,0 +1,213 @@
+import struct
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from env import Estimation, INFO_KEYS
+from functions import change_state
+
+# commands sent to the workers, packed with the ring buffer slot to write into and a reset seed, -1 for none
+RESET, STEP, CLOSE = range(3)
+COMMAND = struct.Struct('<Biq')
+
+
+def buffer_specs(n_envs, n_slots, obs_dim):
+	"""
+	A function which returns the shape and dtype of every shared buffer of the pool
+	"""
+	return {
+		'actions': ((n_envs, 3), np.int64),
+		'obs': ((n_slots, n_envs) + obs_dim, np.float64),
+		'rewards': ((n_slots, n_envs, 4), np.float64),
+		'dones': ((n_slots, n_envs), bool),
+		'scores': ((n_slots, n_envs, 4), np.float64),
+		'current_player': ((n_slots, n_envs), np.int8),
+		'legal_cards': ((n_slots, n_envs, 52), bool),
+		'legal_calls': ((n_slots, n_envs, 14), bool),
+		'legal_trumps': ((n_slots, n_envs, 4), bool),
+	}
+
+
+def attach_buffers(names, specs):
+	"""
+	A function which maps shared memory blocks by name to numpy arrays
+	"""
+	blocks, arrays = [], {}
+	for key, (shape, dtype) in specs.items():
+		block = shared_memory.SharedMemory(name=names[key])
+		blocks.append(block)
+		arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+	return blocks, arrays
+
+
+def write_step(env, players, info, arrays, slot, i):
+	"""
+	A function which writes the observation, seat and legal masks of env i into a slot, the
+	info keys of INFO_KEYS being the only ones the workers compute
+	"""
+	arrays['obs'][slot, i] = env.state
+	arrays['current_player'][slot, i] = players.index(info['current_player'])
+
+	for key in INFO_KEYS[1:]:
+		arrays[key][slot, i] = info[key]
+
+
+def spawn_seeds(seed, n_envs):
+	"""
+	A function which derives the independent seed sequence of every environment from a seed,
+	the same for any number of workers
+	"""
+	return np.random.SeedSequence(seed).spawn(n_envs)
+
+
+def worker(conn, names, specs, envs, state_func):
+	"""
+	A function which runs a chunk of the pool's environments in a worker process
+	"""
+	blocks, arrays = attach_buffers(names, specs)
+	players = list('ABCD')
+	n_envs = len(arrays['actions'])
+	games = {i: Estimation(state_func=state_func, players=players[:], info_fields=INFO_KEYS) for i in envs}
+	try:
+		while True:
+			command, slot, seed = COMMAND.unpack(conn.recv_bytes())
+			if command == CLOSE:
+				break
+			try:
+				seeds = spawn_seeds(seed, n_envs) if seed >= 0 else None
+				for i, env in games.items():
+					if command == RESET:
+						_, info = env.reset(seed=seeds[i] if seeds else None)
+						arrays['rewards'][slot, i] = 0
+						arrays['dones'][slot, i] = False
+						arrays['scores'][slot, i] = 0
+					else:
+						_, rewards, done, info = env.step(arrays['actions'][i])
+						arrays['rewards'][slot, i] = [rewards.get(player, 0) for player in players]
+						arrays['dones'][slot, i] = done
+
+						# write the final scores and start a new game, the scores of unfinished games being zero
+						if done:
+							arrays['scores'][slot, i] = [env.scores[player] for player in players]
+							_, info = env.reset()
+						else:
+							arrays['scores'][slot, i] = 0
+					write_step(env, players, info, arrays, slot, i)
+				conn.send_bytes(b'')
+			except Exception:
+				conn.send_bytes(traceback.format_exc().encode())
+	finally:
+		for block in blocks:
+			block.close()
+
+
+class SubprocEstimationPool:
+	"""
+	A class running Estimation instances in worker processes
+
+	Workers write observations, rewards, dones, final scores, current seats and legal action
+	masks straight into a ring of shared memory slots, so no observation is pickled per step.
+	The arrays returned by reset and step_wait are views of a slot, which stay valid until
+	the ring wraps around n_slots steps later. Finished games are reset automatically,
+	their final scores being kept in info['scores'], which is zero for the other games.
+	"""
+	def __init__(self, n_envs, n_workers=None, n_slots=2, state_func=change_state):
+		self.n_envs = n_envs
+		self.n_workers = min(n_workers or mp.cpu_count(), n_envs)
+		self.n_slots = n_slots
+		self.slot = 0
+		self.waiting = False
+
+		obs_dim = Estimation(state_func=state_func, players=list('ABCD')).reset()[0].shape
+		self.specs = buffer_specs(n_envs, n_slots, obs_dim)
+		self.blocks, self.arrays, names = [], {}, {}
+		for key, (shape, dtype) in self.specs.items():
+			size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+			block = shared_memory.SharedMemory(create=True, size=size)
+			self.blocks.append(block)
+			self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+			names[key] = block.name
+
+		self.conns, self.processes = [], []
+		for envs in np.array_split(np.arange(n_envs), self.n_workers):
+			conn, child_conn = mp.Pipe()
+			process = mp.Process(target=worker, args=(child_conn, names, self.specs, list(envs), state_func), daemon=True)
+			process.start()
+			child_conn.close()
+			self.conns.append(conn)
+			self.processes.append(process)
+
+
+	def send(self, command, seed=-1):
+		for conn in self.conns:
+			conn.send_bytes(COMMAND.pack(command, self.slot, seed))
+		self.waiting = True
+
+
+	def wait(self):
+		errors = [conn.recv_bytes() for conn in self.conns]
+		self.waiting = False
+		for error in errors:
+			if error:
+				raise RuntimeError('a worker failed:\n' + error.decode())
+
+
+	def view(self):
+		"""
+		A method which returns the observations, rewards, dones and info of the current slot
+		"""
+		slot = self.slot
+		info = {key: self.arrays[key][slot] for key in ['current_player', 'scores', 'legal_cards', 'legal_calls', 'legal_trumps']}
+		return self.arrays['obs'][slot], self.arrays['rewards'][slot], self.arrays['dones'][slot], info
+
+
+	def reset(self, seed=None):
+		"""
+		A method which resets all environments and returns their observations and info
+
+		A non-negative int seed gives every environment its own stream spawned from it, so
+		environment i plays the same games whatever the number of workers
+		"""
+		self.send(RESET, -1 if seed is None else seed)
+		self.wait()
+		obs, _, _, info = self.view()
+		return obs, info
+
+
+	def step_async(self, actions):
+		"""
+		A method which hands an (n_envs, 3) array of actions to the workers without waiting
+		"""
+		self.arrays['actions'][:] = actions
+		self.slot = (self.slot + 1) % self.n_slots
+		self.send(STEP)
+
+
+	def step_wait(self):
+		"""
+		A method which waits for the workers to step and returns observations, rewards, dones and info
+		"""
+		self.wait()
+		return self.view()
+
+
+	def step(self, actions):
+		self.step_async(actions)
+		return self.step_wait()
+
+
+	def close(self):
+		"""
+		A method which stops the workers and frees the shared memory
+		"""
+		if self.waiting:
+			self.wait()
+		for conn in self.conns:
+			conn.send_bytes(COMMAND.pack(CLOSE, 0, -1))
+		for process in self.processes:
+			process.join()
+		self.arrays = {}
+		for block in self.blocks:
+			block.close()
+			block.unlink()
+		self.blocks = []
@@ -0,0 +1,68 @@
+import json
+import time
+from collections import defaultdict
+
+
+class Profiler:
+	"""
+	A class which accumulates the wall time and calls of named sections of code
+
+	Sections are timed by taking profiler.clock() at their start and passing it to
+	profiler.add(name, start) at their end. With trace=True every section is also kept
+	as an event, to be exported as a Chrome trace viewable in chrome://tracing or Perfetto.
+	"""
+	def __init__(self, trace=False):
+		self.clock = time.perf_counter
+		self.times = defaultdict(float)
+		self.calls = defaultdict(int)
+		self.events = [] if trace else None
+
+
+	def add(self, name, start):
+		"""
+		A method which adds a section ending now and returns the time it ended at
+		"""
+		end = self.clock()
+		self.times[name] += end - start
+		self.calls[name] += 1
+		if self.events is not None:
+			self.events.append((name, start, end))
+		return end
+
+
+	def stats(self):
+		"""
+		A method which returns the calls, total seconds and mean microseconds per call of every section
+		"""
+		return {
+			name: {'calls': self.calls[name], 'total': total, 'mean_us': total / self.calls[name] * 1e6}
+			for name, total in self.times.items()
+		}
+
+
+	def reset(self):
+		self.times.clear()
+		self.calls.clear()
+		if self.events is not None:
+			self.events.clear()
+
+
+	def chrome_trace(self):
+		"""
+		A method which returns the traced sections in the Chrome trace event format
+		"""
+		events = [
+			{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6, 'pid': 0, 'tid': 0}
+			for name, start, end in self.events or []
+		]
+		return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+	def export_trace(self, path):
+		"""
+		A method which writes the traced sections to a Chrome trace JSON file
+		"""
+		if self.events is None:
+			raise ValueError('the profiler was created without trace=True')
+		with open(path, 'w') as f:
+			json.dump(self.chrome_trace(), f)
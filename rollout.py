@@ -0,0 +1,130 @@
+import numpy as np
+from vector_env import VectorEstimation
+
+
+def unseen_cards(env):
+	"""
+	A function which returns the tokens of the cards the current player hasn't seen
+	"""
+	seen = env.hands[env.current_player()].copy()
+	seen[env.played] = True
+	seen[env.table] = True
+	return np.flatnonzero(~seen)
+
+
+def sample_deals(env, n, attempts=100, rng=None):
+	"""
+	A function which samples n deals of the unseen cards to the other players, consistent with the
+	current player's view: the other players hold as many cards as they have left and none of the
+	suits they are known to be void in. Returns an (n, 4) array of hands, seat i being the i-th
+	player of env.hands.
+
+	Cards go one at a time to a player with a probability proportional to the player's free slots,
+	which is uniform over the deals without voids. The most constrained suits are dealt first and
+	the few deals that run into a dead end are sampled again. The draws come from env.rng unless
+	another generator is passed.
+	"""
+	rng = env.rng if rng is None else rng
+	players = list(env.hands)
+	player = env.current_player()
+	others = [p for p in players if p != player]
+	on_table = env.players[:len(env.table)]
+	capacity = np.array([13 - env.round - (p in on_table) for p in others])
+	voids = np.array([env.voids[p] for p in others])
+
+	cards = unseen_cards(env)
+	if capacity.sum() != len(cards):
+		raise ValueError('the unseen cards do not match the cards left in the other players hands')
+
+	# deal the cards of suits fewer players can hold first
+	suits = cards // 13
+	cards = cards[np.argsort((~voids).sum(axis=0)[suits], kind='stable')]
+	suits = cards // 13
+
+	owners = np.zeros((n, len(cards)), dtype=np.int64)
+	pending = np.arange(n)
+	for _ in range(attempts):
+		free = np.tile(capacity, (len(pending), 1))
+		failed = np.zeros(len(pending), dtype=bool)
+		for j, suit in enumerate(suits):
+			weights = np.where(voids[:, suit], 0, free)
+			cumulative = np.cumsum(weights, axis=1)
+			failed |= cumulative[:, -1] == 0
+			owner = np.argmax(cumulative > rng.random((len(pending), 1)) * cumulative[:, -1:], axis=1)
+			owners[pending, j] = owner
+			free[np.arange(len(pending)), owner] -= 1
+		pending = pending[failed]
+		if not len(pending):
+			break
+	else:
+		raise ValueError('could not sample deals consistent with the known voids')
+
+	hands = np.zeros((n, 4, 52), dtype=bool)
+	hands[:, players.index(player)] = env.hands[player]
+	for i, p in enumerate(others):
+		rows, columns = np.nonzero(owners == i)
+		hands[rows, players.index(p), cards[columns]] = True
+	return hands
+
+
+def random_policy(vec, info):
+	"""
+	The default rollout policy, playing a random legal card
+	"""
+	return vec.sample(info)
+
+
+def play_out(env, cards, hands, policy=random_policy, seed=None):
+	"""
+	A function which plays every candidate card in every sampled deal to the end of the game,
+	returning the (cards, deals, 4) tricks and scores of each seat
+	"""
+	n_cards, n_deals = len(cards), len(hands)
+	vec = VectorEstimation(n_cards * n_deals, seed=seed)
+	vec.set_game(env, np.tile(hands, (n_cards, 1, 1)))
+	info = vec.update_info()
+
+	# the current player plays each candidate card, then the policy takes over
+	actions = np.zeros((vec.n, 3), dtype=np.int64)
+	actions[:, 0] = np.repeat(cards, n_deals)
+	_, _, _, info = vec.step(actions)
+	while not vec.done.all():
+		_, _, _, info = vec.step(policy(vec, info))
+
+	shape = (n_cards, n_deals, 4)
+	return vec.tricks.reshape(shape), vec.scores.reshape(shape)
+
+
+def rollout(env, n=64, policy=random_policy, pool=None, chunks=None):
+	"""
+	A function which estimates the tricks and scores each legal card of the current player leads to,
+	averaged over n determinizations of the unseen cards played out by a policy
+
+	The policy is called with the VectorEstimation of the rollouts and its info, and returns an
+	(n, 3) array of actions. Passing a process pool (e.g. multiprocessing.Pool) splits the
+	determinizations into chunks played out in parallel. The deals and play outs are drawn from
+	env.rng, so the rollouts of a seeded game are reproducible.
+
+	Returns a dict with the candidate cards, the players in seat order, and the (cards, 4)
+	expected tricks and scores of each seat
+	"""
+	if not env.phase_3 or env.done:
+		raise ValueError('rollouts start from the playing phase')
+
+	cards = np.flatnonzero(env.legal_cards())
+	hands = sample_deals(env, n)
+	if pool is None:
+		tricks, scores = play_out(env, cards, hands, policy, env.rng.integers(2 ** 63))
+	else:
+		chunks = [chunk for chunk in np.array_split(hands, chunks or getattr(pool, '_processes', 1)) if len(chunk)]
+		seeds = env.rng.integers(2 ** 63, size=len(chunks))
+		results = pool.starmap(play_out, [(env, cards, chunk, policy, seed) for chunk, seed in zip(chunks, seeds)])
+		tricks = np.concatenate([result[0] for result in results], axis=1)
+		scores = np.concatenate([result[1] for result in results], axis=1)
+
+	return {
+		'cards': cards,
+		'players': list(env.hands),
+		'tricks': tricks.mean(axis=1),
+		'scores': scores.mean(axis=1),
+	}
@@ -0,0 +1,124 @@
+import asyncio
+from functools import partial
+import numpy as np
+from env import Estimation, INFO_KEYS
+from functions import change_state, sample_actions
+
+
+def random_policy(obs, info, rng=np.random):
+	"""
+	A batched policy playing random legal cards, calls and trump suits drawn from rng
+	"""
+	return sample_actions(info, rng)
+
+
+class InferenceScheduler:
+	"""
+	A class which plays many games as coroutines sharing a batched policy
+
+	Every game suspends at each decision, handing its observation and legal masks to the
+	scheduler, which calls policy(obs, info) once for a batch of waiting decisions and resumes
+	their games with the chosen actions. obs is an (n, obs_dim) array and info holds the
+	stacked legal_cards, legal_calls and legal_trumps masks and the seats of the current
+	players, and the policy returns an (n, 3) array of actions.
+
+	A batch is decided once batch_size decisions are waiting, or max_wait seconds after the
+	first of them. With max_wait=0, the batch holds every game ready to decide.
+
+	Without a policy, random legal actions are drawn from a generator seeded by seed.
+	"""
+	def __init__(self, policy=None, batch_size=256, max_wait=0, state_func=change_state, seed=None):
+		self.policy = policy or partial(random_policy, rng=np.random.default_rng(seed))
+		self.batch_size = batch_size
+		self.max_wait = max_wait
+		self.state_func = state_func
+		self.pending = []
+		self.timer = None
+		self.calls = 0
+		self.decisions = 0
+
+
+	async def decide(self, obs, info):
+		"""
+		A method which waits for the action of a decision to be chosen in a batch
+		"""
+		future = asyncio.get_running_loop().create_future()
+		self.pending.append((obs, info, future))
+		if len(self.pending) >= self.batch_size:
+			self.flush()
+		elif self.timer is None:
+			self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+		return await future
+
+
+	def flush(self):
+		"""
+		A method which calls the policy on the waiting decisions, batch_size at a time
+		"""
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+
+		while len(self.pending) >= self.batch_size or (self.pending and self.timer is None):
+			batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+			obs = np.stack([obs for obs, _, _ in batch])
+			info = {key: np.stack([info[key] for _, info, _ in batch]) for key in INFO_KEYS[1:]}
+			info['current_player'] = np.array([info['current_player'] for _, info, _ in batch])
+			try:
+				actions = self.policy(obs, info)
+			except Exception as e:
+				for _, _, future in batch:
+					future.set_exception(e)
+				continue
+			finally:
+				self.calls += 1
+				self.decisions += len(batch)
+
+			for action, (_, _, future) in zip(actions, batch):
+				future.set_result(action)
+
+			# a partial batch left behind waits for more decisions
+			if self.pending and len(self.pending) < self.batch_size:
+				self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+
+
+	async def play_game(self, env, seed=None):
+		"""
+		A method which plays a game to the end and returns the final scores by seat
+		"""
+		obs, info = env.reset(seed=seed)
+		players = list(env.hands)
+		info = dict(info, current_player=players.index(info['current_player']))
+		done = False
+		while not done:
+			action = await self.decide(obs, info)
+			obs, _, done, info = env.step(action)
+			info = dict(info, current_player=players.index(info['current_player']))
+		return np.array([env.scores[player] for player in players])
+
+
+	async def selfplay(self, games, tables=None, seed=None):
+		"""
+		A method which plays a number of games on concurrent tables, by default as many as batch_size,
+		and returns their final scores by seat as a (games, 4) array. A seed gives every game its own
+		stream spawned from it, so the games don't depend on the number of tables.
+		"""
+		tables = min(tables or self.batch_size, games)
+		seeds = np.random.SeedSequence(seed).spawn(games) if seed is not None else [None] * games
+		scores = np.zeros((games, 4))
+		games = iter(range(games))
+
+		async def table():
+			env = Estimation(state_func=self.state_func, players=list('ABCD'), info_fields=INFO_KEYS)
+			for game in games:
+				scores[game] = await self.play_game(env, seeds[game])
+
+		await asyncio.gather(*[table() for _ in range(tables)])
+		return scores
+
+
+	def run(self, games, tables=None, seed=None):
+		"""
+		A method which runs selfplay in a new event loop
+		"""
+		return asyncio.run(self.selfplay(games, tables, seed))
@@ -0,0 +1,255 @@
+import struct
+import asyncio
+import argparse
+from collections import deque
+import numpy as np
+from env import Estimation, INFO_KEYS
+from functions import change_state
+
+# commands sent by clients, each request being a fixed 16 bytes: command, table, reset seed (-1 for none) and action
+RESET, STEP, CLOSE = range(3)
+REQUEST = struct.Struct('<BIq3b')
+REQUEST_DTYPE = np.dtype([('command', 'u1'), ('table', '<u4'), ('seed', '<i8'), ('action', 'i1', 3)])
+
+# response statuses
+OK, UNKNOWN_TABLE, FAILED = range(3)
+
+# sent by the server on connection, the size of the observations
+HELLO = struct.Struct('<I')
+
+
+def response_dtype(obs_dim):
+	"""
+	A function which returns the dtype of the fixed size responses, the legal card, call and trump
+	masks being packed into 9 bytes of bits
+	"""
+	return np.dtype([
+		('table', '<u4'), ('status', 'u1'), ('seat', 'i1'), ('done', '?'),
+		('rewards', '<f4', 4), ('scores', '<f4', 4), ('obs', '<f4', obs_dim), ('legal', 'u1', 9),
+	])
+
+
+class EstimationServer:
+	"""
+	A class serving Estimation tables to remote agents over TCP or a Unix domain socket
+
+	Every connection can run any number of tables, created by resetting them. Requests are
+	fixed size frames which clients may pipeline, all the requests received in a read being
+	handled as a batch and answered with a single write, each response naming its table.
+	"""
+	def __init__(self, state_func=change_state):
+		self.state_func = state_func
+		self.obs_dim = Estimation(state_func=state_func, players=list('ABCD')).reset()[0].size
+		self.response = response_dtype(self.obs_dim)
+		self.players = list('ABCD')
+
+
+	def new_table(self):
+		return Estimation(state_func=self.state_func, players=self.players[:], info_fields=INFO_KEYS)
+
+
+	def handle_request(self, tables, request, responses, i):
+		"""
+		A method which runs a request on its table and writes its response into row i
+		"""
+		command, table = request['command'], int(request['table'])
+		responses['table'][i] = table
+		if command == RESET:
+			if table not in tables:
+				tables[table] = self.new_table()
+			seed = int(request['seed'])
+			obs, info = tables[table].reset(seed=seed if seed >= 0 else None)
+		elif table not in tables:
+			responses['status'][i] = UNKNOWN_TABLE
+			return
+		elif command == CLOSE:
+			del tables[table]
+			return
+		else:
+			env = tables[table]
+			obs, rewards, done, info = env.step(request['action'].astype(np.int64))
+			responses['rewards'][i] = [rewards.get(player, 0) for player in self.players]
+			responses['done'][i] = done
+			if done:
+				responses['scores'][i] = [env.scores[player] for player in self.players]
+
+		responses['seat'][i] = self.players.index(info['current_player'])
+		responses['obs'][i] = obs
+		responses['legal'][i] = np.packbits(np.concatenate([info['legal_cards'], info['legal_calls'], info['legal_trumps']]))
+
+
+	async def handle(self, reader, writer):
+		"""
+		A method which serves a connection until it's closed, its tables being closed with it
+		"""
+		tables = {}
+		writer.write(HELLO.pack(self.obs_dim))
+		pending = b''
+		try:
+			while True:
+				data = await reader.read(1 << 16)
+				if not data:
+					break
+				data = pending + data
+				n = len(data) // REQUEST.size
+				pending = data[n * REQUEST.size:]
+				requests = np.frombuffer(data, REQUEST_DTYPE, count=n)
+				responses = np.zeros(n, self.response)
+				for i, request in enumerate(requests):
+					try:
+						self.handle_request(tables, request, responses, i)
+					except Exception:
+						responses['status'][i] = FAILED
+				writer.write(responses.tobytes())
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+
+	async def start(self, host='127.0.0.1', port=0, path=None):
+		"""
+		A method which starts serving on a Unix domain socket if a path is given, or on a TCP port,
+		and returns the asyncio server
+		"""
+		if path is not None:
+			return await asyncio.start_unix_server(self.handle, path=path)
+		return await asyncio.start_server(self.handle, host, port)
+
+
+class EstimationClient:
+	"""
+	A class which plays tables of an EstimationServer
+
+	reset, step and close_table send a request straight away and return a future of its
+	response, so requests for many tables can be in flight at once and awaited together.
+	Seats are numbered 0 to 3 in info['current_player'] and the rewards and scores arrays.
+	"""
+	def __init__(self, reader, writer, obs_dim):
+		self.reader = reader
+		self.writer = writer
+		self.response = response_dtype(obs_dim)
+		self.pending = {}
+		self.task = asyncio.ensure_future(self.receive())
+
+
+	@classmethod
+	async def connect(cls, host='127.0.0.1', port=None, path=None):
+		"""
+		A method which connects to a server by Unix domain socket path or TCP host and port
+		"""
+		if path is not None:
+			reader, writer = await asyncio.open_unix_connection(path)
+		else:
+			reader, writer = await asyncio.open_connection(host, port)
+		obs_dim, = HELLO.unpack(await reader.readexactly(HELLO.size))
+		return cls(reader, writer, obs_dim)
+
+
+	def send(self, command, table, seed=-1, action=(0, 0, 0)):
+		future = asyncio.get_running_loop().create_future()
+		self.pending.setdefault(table, deque()).append((command, future))
+		self.writer.write(REQUEST.pack(command, table, seed, *map(int, action)))
+		return future
+
+
+	def reset(self, table, seed=None):
+		"""
+		A method which resets a table, creating it if new, and returns a future of its observation and info
+		"""
+		return self.send(RESET, table, -1 if seed is None else seed)
+
+
+	def step(self, table, action):
+		"""
+		A method which steps a table and returns a future of its observation, rewards, done and info
+		"""
+		return self.send(STEP, table, action=action)
+
+
+	def close_table(self, table):
+		return self.send(CLOSE, table)
+
+
+	async def step_many(self, actions):
+		"""
+		A method which steps several tables given a dict of actions by table, with one write,
+		and returns their results by table
+		"""
+		tables = list(actions)
+		results = await asyncio.gather(*[self.step(table, actions[table]) for table in tables])
+		return dict(zip(tables, results))
+
+
+	async def receive(self):
+		"""
+		A method which reads responses and resolves the futures of their requests, in order per table
+		"""
+		size = self.response.itemsize
+		pending = b''
+		try:
+			while True:
+				data = await self.reader.read(1 << 16)
+				if not data:
+					break
+				data = pending + data
+				n = len(data) // size
+				pending = data[n * size:]
+				responses = np.frombuffer(data, self.response, count=n)
+				legal = np.unpackbits(responses['legal'], axis=1).astype(bool)
+				for i, response in enumerate(responses):
+					table = int(response['table'])
+					command, future = self.pending[table].popleft()
+					if not self.pending[table]:
+						del self.pending[table]
+					if future.done():
+						continue
+					if response['status'] != OK:
+						future.set_exception(RuntimeError('request {} on table {} failed with status {}'.format(command, table, response['status'])))
+					elif command == CLOSE:
+						future.set_result(None)
+					else:
+						future.set_result(self.unpack(response, legal[i], command))
+		finally:
+			for futures in self.pending.values():
+				for _, future in futures:
+					if not future.done():
+						future.set_exception(ConnectionError('the server closed the connection'))
+			self.pending.clear()
+
+
+	def unpack(self, response, legal, command):
+		info = {
+			'current_player': int(response['seat']),
+			'legal_cards': legal[:52],
+			'legal_calls': legal[52:66],
+			'legal_trumps': legal[66:70],
+		}
+		obs = response['obs'].copy()
+		if command == RESET:
+			return obs, info
+		if response['done']:
+			info['scores'] = response['scores'].copy()
+		return obs, response['rewards'].copy(), bool(response['done']), info
+
+
+	async def close(self):
+		self.writer.close()
+		await self.writer.wait_closed()
+		await self.task
+
+
+async def serve_forever(host, port, path):
+	server = await EstimationServer().start(host, port, path)
+	async with server:
+		await server.serve_forever()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve Estimation tables to remote agents')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--path', help='Unix domain socket to serve on instead of TCP')
+	args = parser.parse_args()
+	asyncio.run(serve_forever(args.host, args.port, args.path))
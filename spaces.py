@@ -1,5 +1,4 @@
 import numpy as np
-import random
 
 class Action:
     """ 
@@ -13,23 +12,18 @@ class Action:
         """
         A method which randomly samples a viable card from the current players hand and return card token
         """
-        player = self.env.current_player()
-        player_cards = self.env.players_cards[player]
-        if self.env.table_suit:
-            legal_cards = [card for card in player_cards if card[1] == self.env.table_suit]
-            if not legal_cards:
-                legal_cards = player_cards
-        else:
-            legal_cards = player_cards
-
-        card = random.choice(legal_cards)
+        rng = self.env.rng
+        legal = self.env.legal_actions()
+        cards = np.flatnonzero(legal['legal_cards'])
+        card = cards[rng.integers(len(cards))]
 
+        calls = legal['legal_calls']
         if len(self.env.dash_players) == 2:
-            call = np.random.randint(1, 14)
-        else:
-            call = np.random.choice(14)
+            calls[0] = False
+        calls = np.flatnonzero(calls)
+        call = calls[rng.integers(len(calls))]
 
-        return [self.env.deck.card_to_token[card], call, np.random.choice(4)]
+        return [card, call, rng.integers(4)]
 
 
 
@@ -43,7 +37,102 @@ class Observation:
         self.dim = self.change_state(self.env).shape
 
     def next(self):
+        if self.env.incremental_state:
+            return self.env.incremental_state.next()
         return self.change_state(self.env)
 
 
 
+class IncrementalState:
+    """
+    A class which keeps the change_state observation of every player up to date as the game goes,
+    so the observation of the current player is a copy instead of a rebuild
+    """
+    def __init__(self, env, players=None):
+        players = players or env.players
+        self.env = env
+        self.state_array = np.zeros((4, 65))
+        self.states = dict(zip(players, self.state_array))
+        self.bids = {player: 0 for player in players}
+        self.tricks = {player: 0 for player in players}
+        self.offsets = {}
+
+    def reset(self):
+        """
+        A method which zeroes the states, bids and tricks in place for a new game
+        """
+        self.state_array[:] = 0
+        for player in self.bids:
+            self.bids[player] = 0
+            self.tricks[player] = 0
+
+    def deal(self):
+        """
+        A method which marks the dealt cards in each player's state
+        """
+        for player in self.env.players:
+            self.states[player][:52] = self.env.hands[player]
+        self.seat()
+
+    def seat(self):
+        """
+        A method which lays out the bids and tricks of each state after the players are reordered
+        """
+        for player in self.env.players:
+            others = [p for p in self.env.players if p != player]
+            offsets = {p: 54 + (i * 2) for i, p in enumerate(others)}
+            offsets[player] = 52
+            state = self.states[player]
+            for p, offset in offsets.items():
+                state[offset] = self.bids[p]
+                state[offset + 1] = self.tricks[p]
+            self.offsets[player] = offsets
+
+    def __setstate__(self, state):
+        # the states are views of the state array, which unpickling doesn't keep
+        self.__dict__.update(state)
+        self.states = dict(zip(self.states, self.state_array))
+
+    def snapshot(self):
+        return self.state_array.copy(), dict(self.bids), dict(self.tricks)
+
+    def restore(self, snapshot):
+        state_array, bids, tricks = snapshot
+        self.state_array[:] = state_array
+        self.bids = dict(bids)
+        self.tricks = dict(tricks)
+        self.seat()
+
+    def set_bids(self):
+        """
+        A method which copies the estimations of all players after the bidding phase
+        """
+        for player in self.env.players:
+            self.bids[player] = self.env.bids[player]
+        self.seat()
+
+    def set_bid(self, player, bid):
+        self.bids[player] = bid
+        for p, state in self.states.items():
+            state[self.offsets[p][player]] = bid
+
+    def add_trick(self, player):
+        self.tricks[player] += 1
+        for p, state in self.states.items():
+            state[self.offsets[p][player] + 1] = self.tricks[player]
+
+    def place(self, token, label):
+        """
+        A method which changes the label of a card in all states, 2 for the table and 3 for played
+        """
+        for state in self.states.values():
+            state[token] = label
+
+    def next(self):
+        state = self.states[self.env.current_player()].copy()
+        state[60] = self.env.table_suit_token
+        state[61] = self.env.trump_suit_token
+        state[62] = self.env.total_tricks
+        state[63] = self.env.round
+        state[64] = self.env.order
+        return state
@@ -1,6 +1,21 @@
+import os
+import tempfile
 import unittest
 import numpy as np
-from env import Estimation
+from env import Estimation, DEAL_SEATS
+from vector_env import VectorEstimation
+from pool import SubprocEstimationPool
+from rollout import rollout, sample_deals
+from deals import generate_deals, save_deals, load_deals
+from trajectories import TrajectoryWriter, read_trajectories
+from server import EstimationServer, EstimationClient
+from scheduler import InferenceScheduler
+from encoders import ENCODERS, get_encoder
+from tournament import run_tournament, random_agent, WORKER
+from benchmarks import compare
+import json
+import pickle
+import asyncio
 from functions import *
 
 class TestEstimation(unittest.TestCase):
@@ -60,13 +75,22 @@ class TestEstimation(unittest.TestCase):
 
 		env = Estimation()
 		_, _ = env.reset()
-		_, _, _ = env.step((_, 0, 1))
-		_, _, info = env.step((_, 0, 0))
+		_, _, _, _ = env.step((_, 0, 1))
+		_, _, _, info = env.step((_, 0, 0))
 		self.assertEqual(info['illegal_call'], 0)
 		action = [np.random.randn(n) for n in [52, 14, 4]]
 		action = process_action(action, env, info)
 		self.assertEqual(action[1][0], 0)
 
+		# a tied bid goes to the player who bid first, the game being led by the third seat
+		env = Estimation(players=list('ABCD'))
+		env.reset(seed=1, leader=2)
+		for action in [(0, 5, 3), (0, 4, 1), (0, 5, 3), (0, 3, 0)]:
+			env.step(action)
+		self.assertEqual(env.multi['C'], ['bidder'])
+		self.assertEqual(env.multi['A'], [])
+		self.assertEqual(env.players, ['C', 'D', 'A', 'B'])
+
 	def test_reorder_players(self):
 		env = Estimation()
 		_, _ = env.reset()
@@ -100,6 +124,12 @@ class TestEstimation(unittest.TestCase):
 		self.assertFalse(set(env.players_cards['B']).issubset(set(env.players_cards['D'])))
 		self.assertFalse(set(env.players_cards['C']).issubset(set(env.players_cards['D'])))
 
+		# the current player's cards are built once, on first access
+		cards = env.update_info()['current_player_cards']
+		self.assertIsNone(cards.list)
+		self.assertEqual(list(cards), env.players_cards['A'])
+		self.assertIs(cards.cards(), cards.list)
+
 	def test_current_player(self):
 		env = Estimation()
 		_, _ = env.reset()
@@ -137,13 +167,79 @@ class TestEstimation(unittest.TestCase):
 		env = Estimation()
 		_, _ = env.reset()
 		env.phase_2 = True
-		env.last_player = 'D'
+		env.last_player = 3
 		env.order = 3
 		env.total_tricks = 10
 		info = env.update_info()
 		self.assertTrue(info['last_call'])
 		self.assertEqual(info['illegal_call'], 3)
 
+	def test_legal_actions(self):
+		env = Estimation(players=list('ABCD'))
+		_, info = env.reset()
+		self.assertEqual(info['legal_cards'].sum(), 13)
+		_, _, _, info = env.step((0, 0, 1))
+		_, _, _, info = env.step((0, 0, 2))
+		self.assertFalse(info['legal_calls'][0])
+		self.assertEqual(info['legal_calls'].sum(), 13)
+		self.assertNotEqual(sample_legal(np.ones(14), info['legal_calls']), 0)
+
+		_, _, _, info = env.step((0, 5, 1))
+		_, _, _, info = env.step((0, 4, 3))
+		self.assertEqual(env.players[env.last_player], 'D')
+		self.assertTrue(info['last_call'])
+		self.assertFalse(info['legal_calls'][13 - env.total_tricks])
+
+		_, _, _, info = env.step((0, 3, 0))
+		card = np.argmax(info['legal_cards'])
+		_, _, _, info = env.step((card, 0, 0))
+		hand = env.hands[env.current_player()]
+		follow = hand & SUIT_CARDS[card // 13]
+		np.testing.assert_array_equal(info['legal_cards'], follow if follow.any() else hand)
+
+		# sampled actions are legal, for one player or a batch of them
+		card, call, trump = sample_actions(info, np.random.default_rng(0))
+		self.assertTrue(info['legal_cards'][card] and info['legal_calls'][call] and info['legal_trumps'][trump])
+		batch = {key: np.stack([info[key]] * 100) for key in LEGAL_KEYS}
+		actions = sample_actions(batch, np.random.default_rng(0))
+		self.assertEqual(actions.shape, (100, 3))
+		self.assertTrue(info['legal_cards'][actions[:, 0]].all())
+		self.assertEqual(set(actions[:, 0]), set(np.flatnonzero(info['legal_cards'])))
+
+	def test_evaulate_winner(self):
+		env = Estimation(players=list('ABCD'))
+		_, _ = env.reset()
+		env.trump_suit_token = 2
+		env.table_suit_token = 0
+		env.table = [12, 11, 25, 0]
+		self.assertEqual(env.evaulate_winner(), 'A')
+		env.table = [12, 11, 27, 40]
+		self.assertEqual(env.evaulate_winner(), 'C')
+		self.assertEqual(env.trump_suit, 'H')
+		self.assertEqual(env.update_info()['table'], [('A', 'C'), ('K', 'C'), ('3', 'H'), ('3', 'S')])
+
+	def test_trick_winners(self):
+		def winner(table, trump):
+			# the rules of evaulate_winner before the strength table
+			suits = [token // 13 for token in table]
+			suit = trump if trump in suits else suits[0]
+			cards = [token if token // 13 == suit else 0 for token in table]
+			return cards.index(max(cards))
+
+		rng = np.random.default_rng(0)
+		env = Estimation(players=list('ABCD'))
+		env.reset()
+		for _ in range(10):
+			tables = np.argsort(rng.random((200000, 52)), axis=1)[:, :4]
+			trumps = rng.integers(4, size=len(tables))
+			expected = [winner(table, trump) for table, trump in zip(tables.tolist(), trumps.tolist())]
+			np.testing.assert_array_equal(trick_winners(tables, trumps), expected)
+
+		for table, trump, position in zip(tables[:10000].tolist(), trumps.tolist(), expected):
+			env.table, env.trump_suit_token, env.table_suit_token = table, trump, table[0] // 13
+			self.assertEqual(env.evaulate_winner(), env.players[position])
+		self.assertEqual(trick_winners([26, 30, 0, 40], 0), 0)
+
 	def test_zero_sum_probs(self):
 		env = Estimation(players=list('ABCD'))
 		_, _ = env.reset()
@@ -155,6 +251,327 @@ class TestEstimation(unittest.TestCase):
 		self.assertEqual(card_probs[1], 1.0)
 
 
+	def test_incremental_state(self):
+		env = Estimation(players=list('ABCD'), incremental=True)
+		env.reset()
+		state = env.incremental_state
+		for game in range(20):
+			# the state is zeroed by every reset, and rebuilt for new players
+			if game == 15:
+				env.players = list('WXYZ')
+			obs, info = env.reset()
+			self.assertIs(env.incremental_state is state, game < 15)
+			while True:
+				np.testing.assert_array_equal(obs, change_state(env))
+				action = env.action_space.sample()
+				# bid zero often to cover dash calls
+				if env.phase_1 and np.random.rand() < 0.3:
+					action[1] = 0
+				if info.get('illegal_call') == action[1]:
+					action[1] = 1
+				obs, _, done, info = env.step(action)
+				if done:
+					np.testing.assert_array_equal(obs, change_state(env))
+					break
+
+	def test_record(self):
+		env = Estimation(players=list('ABCD'))
+		obs, info = env.reset()
+		while not env.done:
+			action = env.action_space.sample()
+			if env.phase_1:
+				action[1] = max(action[1], 1)
+			tricks, players = env.round, list(env.players)
+			obs, _, _, info = env.step(action)
+			if env.round > tricks:
+				record = env.record[env.round]
+				self.assertEqual(record['players_cards'], dict(env.players_cards))
+				self.assertEqual(record['players_tricks'], dict(env.tricks))
+				self.assertEqual(record['players_order'], players)
+				self.assertEqual(len(record['table']), 4)
+				self.assertEqual(record['table'][0][1], record['table_suit'])
+				self.assertEqual(record['table'], info['played_cards'][-1:-5:-1])
+		self.assertEqual(env.record['rounds'], 13)
+		self.assertIn('scores', env.record)
+
+		# the rounds are keys of the record like the stored ones
+		self.assertIn(13, env.record)
+		self.assertNotIn(14, env.record)
+		self.assertIsNone(env.record.get(0))
+		self.assertEqual(env.record.get(5), env.record[5])
+		self.assertEqual([key for key in env.record if isinstance(key, int)], list(range(1, 14)))
+		self.assertEqual(list(env.record.keys()), list(env.record))
+		self.assertEqual(len(env.record), len(list(env.record)))
+		self.assertEqual(dict(env.record.items())[13], env.record[13])
+		copied = pickle.loads(pickle.dumps(env.record))
+		self.assertEqual(list(copied), list(env.record))
+		self.assertEqual(copied[13], env.record[13])
+
+		env = Estimation(players=list('ABCD'), recording=False)
+		env.reset()
+		while not env.done:
+			action = env.action_space.sample()
+			if env.phase_1:
+				action[1] = max(action[1], 1)
+			env.step(action)
+		self.assertIsNone(env.record)
+
+	def test_seats(self):
+		players = list('ABCD')
+		env = Estimation(players=players)
+		env.reset(seed=2)
+		done = False
+		while not done:
+			info = env.update_info()
+			order = info['player_order']
+			self.assertEqual(order, env.seat_players[env.leader:] + env.seat_players[:env.leader])
+			self.assertEqual(info['current_player'], order[env.order])
+			self.assertEqual([env.order_of(player) for player in order], [0, 1, 2, 3])
+			_, _, done, _ = env.step(env.action_space.sample())
+
+		# the winner of the last trick leads, the passed list isn't reordered
+		self.assertEqual(env.players[0], env.record['players'][env.record['tricks'][12, 5]])
+		self.assertEqual(players, list('ABCD'))
+
+		# the next game seats the players in the order the last one ended in
+		order = env.players
+		env.reset()
+		self.assertEqual(env.seat_players, order)
+		self.assertEqual(list(env.hands), order)
+
+	def test_seat_state(self):
+		env = Estimation(players=list('ABCD'))
+		env.reset(seed=4)
+		state = env.seat_state
+		masks, ints = state.masks, state.ints
+
+		# the per-player mappings read and write the seat arrays
+		env.bids['B'] = (4, 2)
+		env.bids['C'] = 3
+		self.assertEqual(dict(env.bids), {'B': [4, 2], 'C': 3})
+		self.assertEqual((state.estimates[1], state.bid_trumps[1], state.bid_trumps[2]), (4, 2, -1))
+		env.tricks['A'] = [1, 0, 1]
+		self.assertEqual(state.won_counts[0], 2)
+		self.assertEqual(env.tricks['D'], [0, 0, 0])
+		env.multi.add('D', 'risk')
+		env.multi.add('D', '>=8')
+		self.assertEqual(env.multi['D'], ['risk', '>=8'])
+		self.assertEqual(dict(env.multi), {'D': ['risk', '>=8']})
+		env.voids['A'][2] = True
+		self.assertTrue(state.void_masks[0, 2])
+		self.assertEqual(env.hands['C'].sum(), 13)
+		self.assertTrue(np.shares_memory(env.hands['C'], masks))
+
+		# a snapshot restores the arrays in place
+		snapshot = env.snapshot()
+		del env.bids['B']
+		env.multi['D'] = []
+		env.restore(snapshot)
+		self.assertEqual(env.bids['B'], [4, 2])
+		self.assertEqual(env.multi['D'], ['risk', '>=8'])
+
+		# a reset zeroes the same arrays, and an unpickled environment keeps its views on its own arrays
+		env.reset()
+		self.assertIs(state.masks, masks)
+		self.assertIs(state.ints, ints)
+		self.assertEqual((dict(env.bids), dict(env.tricks), dict(env.multi)), ({}, {}, {}))
+		self.assertFalse(state.void_masks.any())
+		copied = pickle.loads(pickle.dumps(env))
+		copied.bids['A'] = 5
+		self.assertEqual(copied.seat_state.estimates[0], 5)
+		self.assertEqual(dict(env.bids), {})
+		np.testing.assert_array_equal(copied.hands['A'], env.hands['A'])
+		self.assertTrue(np.shares_memory(copied.hands['A'], copied.seat_state.masks))
+
+		# copies of the game records keep their games once the arrays and the record are reused by the next games
+		records = []
+		record, tricks = env.record, env.record['tricks']
+		for seed in range(3):
+			env.reset(seed=seed)
+			while not env.done:
+				env.step(env.action_space.sample())
+			records.append((env.record.copy(), dict(env.bids), env.record[13], env.record['deal'].copy()))
+		self.assertIs(env.record, record)
+		self.assertIs(env.record['tricks'], tricks)
+		for record, bids, last_round, deal in records:
+			self.assertEqual(record['bids'], bids)
+			self.assertEqual(len(record['bids']), 4)
+			self.assertEqual(record[13], last_round)
+			np.testing.assert_array_equal(record['deal'], deal)
+
+	def test_match(self):
+		env = Estimation(players=list('ABCD'))
+		results = list(env.match(6, seed=3))
+		self.assertEqual([result['leader'] for result in results], list('ABCDAB'))
+		totals = np.cumsum([list(result['scores'].values()) for result in results], axis=0)
+		np.testing.assert_array_equal([list(result['totals'].values()) for result in results], totals)
+		np.testing.assert_array_equal(env.match_scores, totals[-1])
+
+		# a leader keeps the seats of the last game and bids first
+		seats = env.seat_players
+		env.reset(leader=2)
+		self.assertEqual(env.seat_players, seats)
+		self.assertEqual(env.current_player(), seats[2])
+		while env.round == 0:
+			env.step(env.action_space.sample())
+		self.assertEqual(env.record[1]['players_order'][0], env.record['players'][env.record['tricks'][0, 0]])
+
+		# a match over a deal corpus deals its rows
+		corpus = generate_deals(2, seed=0)
+		for i, _ in enumerate(env.match(corpus)):
+			np.testing.assert_array_equal(env.record['deal'][env.seats['A']], DEAL_SEATS[np.argsort(corpus[i])] == env.seats['A'])
+
+	def test_snapshot(self):
+		for incremental in [False, True]:
+			env = Estimation(players=list('ABCD'), incremental=incremental)
+			env.reset()
+			actions, snapshots = [], []
+			while not env.done:
+				action = env.action_space.sample()
+				actions.append(action)
+				snapshots.append((env.snapshot(), env.state, env.update_info()['legal_cards']))
+				env.step(action)
+			scores = dict(env.scores)
+			record = env.record[13]
+
+			# replay the game from snapshots
+			for i in [0, 3, 4, 10, 30]:
+				snapshot, state, legal_cards = snapshots[i]
+				env.restore(snapshot)
+				np.testing.assert_array_equal(env.observation_space.next(), state)
+				np.testing.assert_array_equal(env.update_info()['legal_cards'], legal_cards)
+				clone = env.clone()
+				for action in actions[i:]:
+					env.step(action)
+				self.assertEqual(dict(env.scores), scores)
+				self.assertEqual(env.record[13], record)
+
+				# the clone plays on independently
+				np.testing.assert_array_equal(clone.state, state)
+				for action in actions[i:]:
+					clone.step(action)
+				self.assertEqual(dict(clone.scores), scores)
+				self.assertEqual(clone.record[13], record)
+
+	def test_update_scores(self):
+		# the points of every multiplier as Estimation.update_scores used to add them up
+		points = {
+			'bidder': (20, -10), 'dash': (23, -23), 'regular': (10, 0), 'risk': (20, -10),
+			'doublerisk': (30, -20), 'with': (20, -10), 'withdoublerisk': (40, -30),
+			'onlywin': (10, 10), 'onlylose': (-10, -10), 'nocall': (10, -10),
+		}
+		def score(multi, estimated, actual):
+			won = estimated == actual
+			X = estimated if won else -abs(estimated - actual)
+			Y = sum(points[name][0 if won else 1] for name in multi if name in points)
+			Z = 2 if '>=8' in multi else 1
+			return (X + Y) * Z + (X + Y) * (Z - 1)
+
+		for _ in range(1000):
+			multi = [name for name in MULTI_BITS if np.random.rand() < 0.2]
+			bits = sum(MULTI_BITS[name] for name in multi)
+			estimated, actual = np.random.randint(14, size=2)
+			self.assertEqual(SCORES[bits, estimated, actual], score(multi, estimated, actual))
+
+		for _ in range(20):
+			env = Estimation(players=list('ABCD'))
+			env.reset()
+			done = False
+			while not done:
+				_, _, done, _ = env.step(env.action_space.sample())
+			for player in env.players:
+				self.assertEqual(env.scores[player], score(env.multi[player], env.bids[player], sum(env.tricks[player])))
+
+	def test_seed(self):
+		# a seed replays the deal and the sampled actions of a game
+		games = []
+		for _ in range(2):
+			env = Estimation(players=list('ABCD'))
+			env.reset(seed=7)
+			actions, done = [], False
+			while not done:
+				actions.append(env.action_space.sample())
+				_, _, done, _ = env.step(actions[-1])
+			games.append((env.record['deal'], np.array(actions), dict(env.scores)))
+		np.testing.assert_array_equal(games[0][0], games[1][0])
+		np.testing.assert_array_equal(games[0][1], games[1][1])
+		self.assertEqual(games[0][2], games[1][2])
+
+		env.reset(seed=8)
+		self.assertFalse((env.record['deal'] == games[0][0]).all())
+
+	def test_info_fields(self):
+		fields = ['current_player', 'legal_cards', 'legal_calls', 'illegal_call']
+		env = Estimation(players=list('ABCD'), info_fields=fields)
+		full = Estimation(players=list('ABCD'))
+		_, info = env.reset()
+		full.reset()
+		full.restore(env.snapshot())
+		done = False
+		while not done:
+			action = env.action_space.sample()
+			_, _, done, info = env.step(action)
+			_, _, _, full_info = full.step(action)
+			self.assertEqual(list(info), [key for key in full_info if key in fields])
+			self.assertEqual(info['current_player'], full_info['current_player'])
+			np.testing.assert_array_equal(info['legal_cards'], full_info['legal_cards'])
+			np.testing.assert_array_equal(info['legal_calls'], full_info['legal_calls'])
+		self.assertRaises(ValueError, Estimation, info_fields=['current_player', 'hand'])
+
+	def test_hand_features(self):
+		env = Estimation(players=list('ABCD'))
+		_, info = env.reset(seed=3)
+		deal = env.hand_masks.copy()
+		for seat, hand in enumerate(deal):
+			suits = [np.flatnonzero(hand[13 * suit:13 * (suit + 1)]) for suit in range(4)]
+			np.testing.assert_array_equal(env.hand_features['suit_lengths'][seat], [len(ranks) for ranks in suits])
+			self.assertEqual(env.hand_features['hcp'][seat], sum(max(rank - 8, 0) for ranks in suits for rank in ranks))
+		np.testing.assert_array_equal(info['hand_features']['hcp'], env.hand_features['hcp'][0])
+
+		# AK, AQ, K with another card, and a long suit of small cards
+		hand = np.zeros((1, 52), dtype=bool)
+		hand[0, [12, 11, 25, 23, 37, 30, 0, 1, 2, 3, 4, 5, 6]] = True
+		features = hand_features(hand)
+		np.testing.assert_array_equal(features['quick_tricks'][0], [2, 1.5, 0.5, 0])
+		np.testing.assert_array_equal(features['winners'][0], [10, 4.5, 4.5, 4])
+
+		# the info holds the features until the bidder plays
+		done = False
+		while not done:
+			self.assertEqual('hand_features' in info, not env.phase_3)
+			_, _, done, info = env.step(env.action_space.sample())
+
+		# hands equal up to the suits share a cache entry, and the cache keeps maxsize hands
+		cache = HandFeatureCache(maxsize=6)
+		for hands in [deal, np.roll(deal, 13, axis=1)]:
+			features = cache(hands)
+			for name, values in hand_features(hands).items():
+				np.testing.assert_array_equal(features[name], values)
+		self.assertEqual((cache.hits, cache.misses), (4, 4))
+		cache(np.roll(deal, 1, axis=1))
+		self.assertEqual(len(cache.table), 6)
+
+		lean = Estimation(players=list('ABCD'), info_fields=['current_player'], feature_cache=cache)
+		lean.reset(seed=3)
+		np.testing.assert_array_equal(lean.hand_features['winners'], hand_features(lean.hand_masks)['winners'])
+
+	def test_profile(self):
+		env = Estimation(players=list('ABCD'), profile='trace')
+		env.reset()
+		steps, done = 0, False
+		while not done:
+			_, _, done, _ = env.step(env.action_space.sample())
+			steps += 1
+
+		stats = env.stats()
+		self.assertEqual(stats['observation']['calls'], steps)
+		self.assertEqual(stats['update_info']['calls'], steps)
+		self.assertEqual(sum(stats[phase]['calls'] for phase in ['bidding', 'calling', 'playing']), steps)
+		self.assertEqual(stats['record']['calls'], 13)
+		self.assertEqual(stats['rewards']['calls'], 13)
+		self.assertEqual(len(env.profiler.chrome_trace()['traceEvents']), steps * 3 + 26)
+		self.assertEqual(Estimation(players=list('ABCD')).stats(), {})
+
 	def test_reward_system(self):
 		env = Estimation(players=list('ABCD'))
 		_, _ = env.reset()
@@ -185,10 +602,438 @@ class TestEstimation(unittest.TestCase):
 		self.assertEqual(int(rewards['D']), -12) 
 		
 
+def deal_from_hands(env):
+	"""
+	A function which returns the deck order that deals the current hands of an Estimation instance
+	"""
+	deal = np.zeros(52, dtype=int)
+	for i, player in enumerate(env.players):
+		for j, card in enumerate(env.players_cards[player]):
+			deal[51 - 4 * j - i] = env.deck.card_to_token[card]
+	return deal
+
+
+class TestDeals(unittest.TestCase):
+	"""
+	Test for the deal corpus
+	"""
+
+	def test_deals(self):
+		deals = generate_deals(100, seed=0, chunk=30)
+		self.assertEqual(deals.dtype, np.uint8)
+		self.assertTrue((np.sort(deals, axis=1) == np.arange(52)).all())
+		np.testing.assert_array_equal(deals, generate_deals(100, seed=0, chunk=30))
+
+		# a deal replays the hands of the game it was taken from
+		env = Estimation(players=list('ABCD'))
+		env.reset()
+		hands = env.hand_masks.copy()
+		env.reset(deal=deal_from_hands(env))
+		np.testing.assert_array_equal(env.hand_masks, hands)
+
+	def test_corpus(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'deals.npy')
+			save_deals(path, 10, seed=1, chunk=4)
+			corpus = load_deals(path)
+			np.testing.assert_array_equal(corpus, generate_deals(10, seed=1))
+
+			env = Estimation(players=list('ABCD'))
+			vec = VectorEstimation(4, auto_reset=True, corpus=corpus)
+			vec.reset()
+			for i in range(4):
+				env.reset(deal=corpus[i])
+				np.testing.assert_array_equal(vec.hands[i], env.hand_masks)
+
+			# finished games take the next deals
+			vec.reset_games(np.arange(4))
+			vec.reset_games(np.arange(4))
+			env.reset(deal=corpus[(4 * 2 + 1) % 10])
+			np.testing.assert_array_equal(vec.hands[1], env.hand_masks)
+			del corpus, vec
+
+
+class TestTrajectoryWriter(unittest.TestCase):
+	"""
+	Test for the trajectory shards
+	"""
+
+	def test_trajectories(self):
+		env = Estimation(players=list('ABCD'))
+		steps = []
+		with tempfile.TemporaryDirectory() as directory:
+			with TrajectoryWriter(directory, shard_size=50) as writer:
+				obs, info = env.reset(seed=0)
+				for _ in range(2):
+					done = False
+					while not done:
+						action = env.action_space.sample()
+						steps.append((obs, list(env.hands).index(env.current_player()), action))
+						obs, rewards, done, info = writer.step(env, obs, info, action)
+					obs, info = env.reset()
+			self.assertEqual(len(os.listdir(directory)), -(-len(steps) // 50))
+
+			batches = list(read_trajectories(directory, batch_size=32))
+			self.assertTrue(all(len(batch['done']) == 32 for batch in batches[:-1]))
+			data = {key: np.concatenate([batch[key] for batch in batches]) for key in batches[0]}
+			self.assertEqual(len(data['done']), len(steps))
+			np.testing.assert_array_equal(data['obs'], [obs for obs, _, _ in steps])
+			np.testing.assert_array_equal(data['player'], [player for _, player, _ in steps])
+			np.testing.assert_array_equal(data['action'], [action for _, _, action in steps])
+			self.assertEqual(np.flatnonzero(data['done'])[-1], len(steps) - 1)
+			self.assertEqual(data['done'].sum(), 2)
+			self.assertEqual(list(np.unique(data['phase'])), [1, 2, 3])
+			self.assertTrue(data['legal_cards'][np.arange(len(steps)), data['action'][:, 0]].all())
+
+			# a shuffled read holds the same steps
+			shuffled = list(read_trajectories(directory, batch_size=32, columns=['obs'], shuffle=True, seed=0))
+			self.assertEqual(list(shuffled[0]), ['obs'])
+			obs = np.concatenate([batch['obs'] for batch in shuffled])
+			np.testing.assert_array_equal(np.unique(obs, axis=0), np.unique(data['obs'], axis=0))
+
+
+class TestEstimationServer(unittest.TestCase):
+	"""
+	Test for the environment server
+	"""
+
+	def test_server(self):
+		async def play():
+			server = await EstimationServer().start(port=0)
+			client = await EstimationClient.connect(port=server.sockets[0].getsockname()[1])
+			env = Estimation(players=list('ABCD'))
+
+			# two games are played on the first table, reseating its players, while the second table plays its first game
+			for game, seed in enumerate([3, 5]):
+				requests = [client.reset(0, seed=seed)] + ([client.reset(1, seed=4)] if game == 0 else [])
+				results = await asyncio.gather(*requests)
+				obs, info = env.reset(seed=seed)
+				np.testing.assert_array_equal(results[0][0], obs)
+				done, other_done = False, game > 0
+				while not done:
+					action = env.action_space.sample()
+					actions = {0: action}
+					if not other_done:
+						actions[1] = np.flatnonzero(results[1][-1]['legal_cards'])[0], 1, 0
+					results = await client.step_many(actions)
+					other_done = other_done or results.get(1, (False,) * 3)[2]
+					obs, rewards, done, info = env.step(action)
+					remote_obs, remote_rewards, remote_done, remote_info = results[0]
+					np.testing.assert_array_equal(remote_obs, obs)
+					self.assertEqual(remote_done, done)
+					self.assertEqual(remote_info['current_player'], 'ABCD'.index(info['current_player']))
+					np.testing.assert_array_equal(remote_info['legal_cards'], info['legal_cards'])
+					# rewards and scores are sent as float32
+					np.testing.assert_allclose(remote_rewards, [rewards.get(player, 0) for player in 'ABCD'], rtol=1e-6)
+				np.testing.assert_allclose(remote_info['scores'], [env.scores[player] for player in 'ABCD'], rtol=1e-6)
+
+			await client.close_table(0)
+			with self.assertRaises(RuntimeError):
+				await client.step(0, action)
+			await client.close()
+			server.close()
+			await server.wait_closed()
+
+		asyncio.run(play())
+
+
+class TestInferenceScheduler(unittest.TestCase):
+	"""
+	Test for the batched inference scheduler
+	"""
+
+	def test_scheduler(self):
+		sizes = []
+		def first_legal(obs, info):
+			sizes.append(len(obs))
+			self.assertEqual(obs.shape[1:], (65,))
+			self.assertTrue(info['legal_cards'].any(axis=1).all())
+			return np.stack([info['legal_cards'].argmax(axis=1), info['legal_calls'].argmax(axis=1), np.zeros(len(obs), dtype=int)], axis=1)
+
+		scheduler = InferenceScheduler(first_legal, batch_size=8)
+		scores = scheduler.run(20, seed=0)
+		self.assertEqual(scores.shape, (20, 4))
+		self.assertEqual(scheduler.decisions, sum(sizes))
+		self.assertEqual(scheduler.calls, len(sizes))
+		self.assertTrue(max(sizes) <= 8 and np.mean(sizes) > 4)
+
+		# seeded games don't depend on the batching
+		scheduler = InferenceScheduler(first_legal, batch_size=3, max_wait=0.001)
+		np.testing.assert_array_equal(scheduler.run(20, tables=5, seed=0), scores)
+
+		# the random policy draws from a generator seeded by the scheduler's seed
+		runs = [InferenceScheduler(batch_size=8, seed=3).run(10, seed=0) for _ in range(2)]
+		np.testing.assert_array_equal(runs[0], runs[1])
+
+		def failing(obs, info):
+			raise ValueError('policy failed')
+		with self.assertRaises(ValueError):
+			InferenceScheduler(failing).run(2)
+
+
+class TestEncoders(unittest.TestCase):
+	"""
+	Test for the observation encoders
+	"""
+
+	def test_encoders(self):
+		self.assertIs(get_encoder('planes', np.uint8), get_encoder('planes', 'uint8'))
+		with self.assertRaises(ValueError):
+			get_encoder('cards')
+
+		env = Estimation(players=list('ABCD'), state_func=get_encoder(list(ENCODERS), np.uint8))
+		obs, _ = env.reset(seed=5)
+		self.assertEqual(obs.dtype, np.uint8)
+		done = False
+		while not done:
+			player = env.current_player()
+			seats = [env.seat_players[(env.seats[player] + i) % 4] for i in range(4)]
+			encoded = {name: get_encoder(name, np.uint8)(env) for name in ENCODERS}
+			np.testing.assert_array_equal(np.concatenate([array.ravel() for array in encoded.values()]), env.state)
+			np.testing.assert_array_equal(encoded['label'], change_state(env))
+
+			# every card is in one location, those unseen being in the other hands
+			planes = encoded['planes']
+			self.assertTrue((planes.sum(axis=0) == 1).all())
+			np.testing.assert_array_equal(planes[3], np.any([env.hands[p] for p in seats[1:]], axis=0))
+			np.testing.assert_array_equal(encoded['suit_counts'].sum(axis=0), planes[[0, 3]].reshape(2, 4, 13).sum(axis=(0, 2)))
+			np.testing.assert_array_equal(encoded['voids'], [env.voids[p] for p in seats[1:]])
+
+			history = encoded['history']
+			for row, p in zip(history, seats):
+				self.assertEqual(list(row[2:2 + env.round]), env.tricks[p])
+				bid = env.bids[p]
+				self.assertEqual(row[0], bid[0] if isinstance(bid, list) and bid else bid or 0)
+
+			obs, _, done, _ = env.step(env.action_space.sample())
+
+		concatenated = pickle.loads(pickle.dumps(env.state_func))
+		np.testing.assert_array_equal(concatenated(env), env.state_func(env))
+
+
+def first_legal_agent(obs, info):
+	return [info['legal_cards'].argmax(), info['legal_calls'].argmax(), 0]
+
+
+def overcalling_agent(obs, info):
+	return [info['legal_cards'].argmax(), 13 - info['legal_calls'][::-1].argmax(), 0]
+
+
+class TestTournament(unittest.TestCase):
+	"""
+	Test for the tournament runner
+	"""
+
+	def test_tournament(self):
+		agents = {'first': first_legal_agent, 'overcall': overcalling_agent, 'random': random_agent}
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'results.jsonl')
+			elo = run_tournament(agents, 40, path, processes=1, chunk=8, seed=0)
+			with open(path) as f:
+				results = [json.loads(line) for line in f]
+			self.assertEqual(len(results), 40)
+			self.assertEqual(elo.ratings, results[-1]['ratings'])
+			self.assertAlmostEqual(sum(elo.ratings.values()), 1500 * 3)
+			self.assertEqual(elo.table()[-1]['agent'], 'random')
+			low, high = elo.interval('first')
+			self.assertTrue(low < elo.ratings['first'] < high)
+
+			# the pool plays the same duplicate matches, the random agents drawing from seeded generators
+			agents = {'first': first_legal_agent, 'random': random_agent}
+			paths = [os.path.join(directory, name) for name in ['serial.jsonl', 'pool.jsonl']]
+			run_tournament(agents, 12, paths[0], processes=1, chunk=4, seed=1)
+			run_tournament(agents, 12, paths[1], processes=2, chunk=4, seed=1)
+			results = []
+			for path in paths:
+				with open(path) as f:
+					results.append([json.loads(line) for line in f])
+			self.assertEqual(results[0], results[1])
+			self.assertEqual([result['deal'] for result in results[0]], list(range(12)))
+			# the serial tournament leaves no agents or env behind
+			self.assertEqual(WORKER, {})
+
+		# the tournament stops early once the ratings are known closely enough
+		elo = run_tournament(agents, 40, processes=1, chunk=5, width=1e6, min_deals=5)
+		self.assertEqual(elo.deals, 5)
+
+
+class TestBenchmarks(unittest.TestCase):
+	"""
+	Test for the benchmark comparison
+	"""
+
+	def test_compare(self):
+		baseline = {'per_second': {'games': 100.0, 'steps': 0.0}, 'us_per_call': {'step': 10.0, 'reset': 0.0}}
+		self.assertEqual(compare(baseline, baseline), [])
+
+		# fewer games per second and more microseconds per call are worse
+		regressions = compare({'per_second': {'games': 70.0}, 'us_per_call': {'step': 13.0}}, baseline)
+		self.assertEqual([line.split(':')[0] for line in regressions], ['per_second.games', 'us_per_call.step'])
+		self.assertEqual(compare({'per_second': {'games': 130.0}, 'us_per_call': {'step': 7.0}}, baseline), [])
+
+		# a zero baseline regresses on any change for the worse
+		regressions = compare({'per_second': {'steps': 5.0}, 'us_per_call': {'reset': 1.0}}, baseline)
+		self.assertEqual([line.split(':')[0] for line in regressions], ['us_per_call.reset'])
+
+
+class TestVectorEstimation(unittest.TestCase):
+	"""
+	Test for class VectorEstimation
+	"""
+
+	def test_matches_estimation(self):
+		n = 16
+		vec = VectorEstimation(n)
+		for _ in range(5):
+			envs = [Estimation(players=list('ABCD')) for _ in range(n)]
+			states = [env.reset()[0] for env in envs]
+			obs, info = vec.reset(np.array([deal_from_hands(env) for env in envs]))
+			np.testing.assert_array_equal(obs, np.array(states))
+
+			while not all(env.done for env in envs):
+				actions = vec.sample(info)
+				# bid zero often to cover dash calls
+				dash = (np.random.rand(n) < 0.3) & info['legal_calls'][:, 0]
+				actions[dash, 1] = 0
+				obs, rewards, dones, info = vec.step(actions)
+				for i, env in enumerate(envs):
+					if env.done:
+						continue
+					state, env_rewards, done, _ = env.step(actions[i])
+					np.testing.assert_array_equal(obs[i], state)
+					self.assertEqual(dones[i], done)
+					for seat, player in enumerate('ABCD'):
+						self.assertEqual(rewards[i, seat], env_rewards.get(player, 0))
 
+			for i, env in enumerate(envs):
+				self.assertEqual(list(vec.scores[i]), [env.scores[player] for player in 'ABCD'])
+
+	def test_set_game(self):
+		env = Estimation(players=list('ABCD'))
+		env.reset()
+		while env.round < 4 or len(env.table) != 2:
+			env.step(env.action_space.sample())
+		vec = VectorEstimation(1)
+		vec.set_game(env, env.hand_masks[None])
+		np.testing.assert_array_equal(vec.observe()[0], env.state)
+		while not env.done:
+			action = env.action_space.sample()
+			obs, rewards, dones, _ = vec.step([action])
+			state, _, _, _ = env.step(action)
+			np.testing.assert_array_equal(obs[0], state)
+		self.assertEqual(list(vec.scores[0]), [env.scores[player] for player in env.hands])
+
+	def test_auto_reset(self):
+		plain, auto = VectorEstimation(8, seed=0), VectorEstimation(8, auto_reset=True, seed=0)
+		_, info = plain.reset()
+		auto.reset()
+		finished = np.zeros(8, dtype=bool)
+		while not finished.all():
+			actions = plain.sample(info)
+			_, rewards, dones, info = plain.step(actions)
+			_, auto_rewards, auto_dones, auto_info = auto.step(actions)
+
+			# games finishing keep their last rewards, with the info of their new deals
+			ending = dones & ~finished
+			np.testing.assert_array_equal(auto_rewards[ending], rewards[ending])
+			np.testing.assert_array_equal(auto_dones[ending], True)
+			if ending.any():
+				rows = np.isin(auto_info['final_games'], np.flatnonzero(ending))
+				np.testing.assert_array_equal(auto_info['final_scores'][rows], plain.scores[ending])
+			np.testing.assert_array_equal(auto_info['phase'][ending], 1)
+			np.testing.assert_array_equal(auto_info['round'][ending], 0)
+			np.testing.assert_array_equal(auto_info['current_player'][ending], auto.current_player()[ending])
+			self.assertTrue((auto_info['legal_cards'][ending].sum(axis=1) == 13).all())
+			finished |= dones
+
+	def test_legal_actions(self):
+		vec = VectorEstimation(4)
+		obs, info = vec.reset()
+		self.assertTrue((info['legal_cards'].sum(axis=1) == 13).all())
+		obs, _, _, info = vec.step([[0, 0, 1]] * 4)
+		obs, _, _, info = vec.step([[0, 0, 2]] * 4)
+		self.assertFalse(info['legal_calls'][:, 0].any())
+		self.assertTrue(info['legal_calls'][:, 1:].all())
+
+
+class TestRollout(unittest.TestCase):
+	"""
+	Test for the determinized rollouts
+	"""
+
+	def midgame(self):
+		env = Estimation(players=list('ABCD'))
+		env.reset()
+		while env.round < 6 or not env.table:
+			env.step(env.action_space.sample())
+		return env
+
+	def test_sample_deals(self):
+		for _ in range(10):
+			env = self.midgame()
+			hands = sample_deals(env, 32)
+			known = np.zeros(52, dtype=int)
+			known[env.played + env.table] = 1
+			self.assertTrue((hands.sum(axis=1) + known == 1).all())
+			for i, player in enumerate(env.hands):
+				self.assertTrue((hands[:, i].sum(axis=1) == env.hands[player].sum()).all())
+				suits = hands[:, i].reshape(-1, 4, 13).any(axis=2)
+				self.assertFalse((suits & env.voids[player]).any())
+
+	def test_rollout(self):
+		env = self.midgame()
+		hand_masks = env.hand_masks.copy()
+		result = rollout(env, 16)
+		np.testing.assert_array_equal(result['cards'], np.flatnonzero(env.legal_cards()))
+		self.assertEqual(result['tricks'].shape, (len(result['cards']), 4))
+		np.testing.assert_allclose(result['tricks'].sum(axis=1), 13)
+
+		# the env is left as it was
+		np.testing.assert_array_equal(env.hand_masks, hand_masks)
+		np.testing.assert_array_equal(env.observation_space.next(), env.state)
+
+
+class TestSubprocEstimationPool(unittest.TestCase):
+	"""
+	Test for class SubprocEstimationPool
+	"""
 
+	def test_step(self):
+		pool = SubprocEstimationPool(6, n_workers=2)
+		try:
+			obs, info = pool.reset()
+			self.assertEqual(obs.shape, (6, 65))
+			finished = np.zeros(6, dtype=bool)
+			while not finished.all():
+				# the legal cards are in the current player's hand
+				self.assertTrue((obs[:, :52][info['legal_cards']] == 1).all())
+				actions = np.zeros((6, 3), dtype=int)
+				for i in range(6):
+					actions[i, 0] = np.random.choice(np.flatnonzero(info['legal_cards'][i]))
+					actions[i, 1] = np.random.choice(np.flatnonzero(info['legal_calls'][i]))
+					actions[i, 2] = np.random.choice(4)
+				obs, rewards, dones, info = pool.step(actions)
+				finished |= dones
 
+				# finished games are reset and their scores kept
+				self.assertTrue((obs[dones, 63] == 0).all())
+				self.assertTrue((info['scores'][dones] != 0).any(axis=1).all())
+				self.assertTrue((info['scores'][~dones] == 0).all())
+		finally:
+			pool.close()
 
+	def test_seed(self):
+		# an environment gets the same deal from a seed whatever the number of workers
+		deals = []
+		for n_workers in [1, 3]:
+			pool = SubprocEstimationPool(3, n_workers=n_workers)
+			try:
+				obs, _ = pool.reset(seed=5)
+				deals.append(obs[:, :52].copy())
+			finally:
+				pool.close()
+		np.testing.assert_array_equal(deals[0], deals[1])
+		self.assertFalse((deals[0][0] == deals[0][1]).all())
 
 
 unittest.main()
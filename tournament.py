@@ -0,0 +1,202 @@
+import json
+import math
+import argparse
+import itertools
+import multiprocessing as mp
+from collections import Counter, defaultdict
+import numpy as np
+from env import Estimation, INFO_KEYS
+from deals import generate_deals
+from functions import sample_actions
+
+# the agents and environment of a worker process, set by init_worker, and the random generator
+# of the chunk of matches it plays, which agents drawing random numbers draw them from
+WORKER = {}
+
+
+def random_agent(obs, info):
+	"""
+	An agent playing random legal cards, calls and trump suits drawn from the generator of the chunk
+	"""
+	return sample_actions(info, WORKER.get('rng', np.random))
+
+
+def play_duplicate(env, agents, lineup, deal):
+	"""
+	A function which plays a deal once for each of the four rotations of a lineup of agents over
+	the seats, so every agent plays every hand, and returns the total score of each agent per seat it
+	held in the lineup
+	"""
+	totals = defaultdict(float)
+	for rotation in range(4):
+		seating = [lineup[(seat + rotation) % 4] for seat in range(4)]
+		obs, info = env.reset(deal=deal, leader=0)
+		done = False
+		while not done:
+			agent = agents[seating[env.seats[env.current_player()]]]
+			obs, _, done, info = env.step(agent(obs, info))
+		for seat, player in enumerate(env.seat_players):
+			totals[seating[seat]] += env.scores[player]
+
+	counts = Counter(lineup)
+	return {name: total / counts[name] for name, total in totals.items()}
+
+
+def init_worker(agents):
+	WORKER['agents'] = agents
+	WORKER['env'] = Estimation(players=list('ABCD'), recording=False, info_fields=INFO_KEYS)
+
+
+def play_matches(chunk):
+	"""
+	A function which plays a chunk of (deal number, lineup, deal) matches in a worker, given the seed
+	sequence of its random generator
+	"""
+	seed, matches = chunk
+	WORKER['rng'] = np.random.default_rng(seed)
+	return [
+		{'deal': i, 'lineup': lineup, 'scores': play_duplicate(WORKER['env'], WORKER['agents'], lineup, deal)}
+		for i, lineup, deal in matches
+	]
+
+
+class Elo:
+	"""
+	A class which rates agents online with Elo, every pair of agents of a match counting as a game
+	won by the agent with the higher duplicate score
+
+	The confidence interval of a rating spans the performance ratings of the win rates within z
+	standard errors of the agent's win rate, around its rating
+	"""
+	def __init__(self, agents, k=16, initial=1500):
+		self.k = k
+		self.ratings = {name: float(initial) for name in agents}
+		self.wins = dict.fromkeys(agents, 0.0)
+		self.games = dict.fromkeys(agents, 0)
+
+
+	def update(self, scores):
+		deltas = defaultdict(float)
+		for a, b in itertools.combinations(scores, 2):
+			outcome = 0.5 if scores[a] == scores[b] else float(scores[a] > scores[b])
+			expected = 1 / (1 + 10 ** ((self.ratings[b] - self.ratings[a]) / 400))
+			deltas[a] += self.k * (outcome - expected)
+			deltas[b] -= self.k * (outcome - expected)
+			self.wins[a] += outcome
+			self.wins[b] += 1 - outcome
+			self.games[a] += 1
+			self.games[b] += 1
+
+		for name, delta in deltas.items():
+			self.ratings[name] += delta
+
+
+	def interval(self, name, z=1.96):
+		"""
+		A method which returns the low and high ends of the confidence interval of a rating
+		"""
+		games = self.games[name]
+		p = (self.wins[name] + 0.5) / (games + 1)
+		error = z * math.sqrt(p * (1 - p) / (games + 1))
+		performance = lambda p: 400 * math.log10(p / (1 - p))
+		half = (performance(min(p + error, 1 - 1e-6)) - performance(max(p - error, 1e-6))) / 2
+		return self.ratings[name] - half, self.ratings[name] + half
+
+
+	def converged(self, width):
+		"""
+		A method which checks whether every confidence interval is narrower than width
+		"""
+		return all(high - low <= width for low, high in map(self.interval, self.ratings))
+
+
+	def table(self):
+		"""
+		A method which returns the rating, confidence interval and games of every agent, best first
+		"""
+		return [
+			{'agent': name, 'rating': rating, 'interval': self.interval(name), 'games': self.games[name]}
+			for name, rating in sorted(self.ratings.items(), key=lambda item: -item[1])
+		]
+
+
+def lineups(agents, rng):
+	"""
+	A function which yields lineups of four agents forever, random ones when there are more than four
+	and the agents repeated in turn when there are fewer
+	"""
+	names = list(agents)
+	while True:
+		if len(names) > 4:
+			yield [names[i] for i in rng.choice(len(names), 4, replace=False)]
+		else:
+			yield [names[i % len(names)] for i in range(4)]
+
+
+def run_tournament(agents, deals, path=None, processes=None, chunk=16, width=None, min_deals=100, k=16, seed=None):
+	"""
+	A function which plays duplicate matches of a dict of agents by name on shared deals and returns their Elo ratings
+
+	Each agent is a callable from an observation and info, holding the legal_cards, legal_calls
+	and legal_trumps masks, to an action. deals is a number of deals to generate from seed or a
+	deal corpus. Matches are played in chunks over a process pool, or in this process with
+	processes=1, and the result of every deal is appended to path as a JSON line as it comes in,
+	with the ratings after it. Given a width, the tournament stops once min_deals are played and
+	every confidence interval is narrower than width. Agents drawing random numbers draw them
+	from WORKER['rng'], seeded for every chunk from seed, and the results are rated in deal order,
+	so a seeded tournament plays the same matches, with the same ratings and stopping point,
+	whatever the number of processes.
+	"""
+	if isinstance(deals, int):
+		deals = generate_deals(deals, seed)
+	rng = np.random.default_rng(seed)
+	matches = [(i, lineup, deal) for i, lineup, deal in zip(range(len(deals)), lineups(agents, rng), deals)]
+	chunks = [matches[start:start + chunk] for start in range(0, len(matches), chunk)]
+
+	# every chunk has its own random generator, so the matches don't depend on the worker playing them
+	chunks = list(zip(np.random.SeedSequence(seed).spawn(len(chunks)), chunks))
+
+	elo = Elo(agents, k)
+	if processes == 1:
+		init_worker(agents)
+		results, pool = map(play_matches, chunks), None
+	else:
+		pool = mp.Pool(processes, initializer=init_worker, initargs=(agents,))
+		results = pool.imap(play_matches, chunks)
+
+	f = open(path, 'a') if path else None
+	played = 0
+	try:
+		for chunk_results in results:
+			for result in chunk_results:
+				elo.update(result['scores'])
+				played += 1
+				if f:
+					f.write(json.dumps(dict(result, ratings=elo.ratings)) + '\n')
+			if f:
+				f.flush()
+			if width is not None and played >= min_deals and elo.converged(width):
+				break
+	finally:
+		if f:
+			f.close()
+		if pool:
+			pool.terminate()
+		else:
+			WORKER.clear()
+	elo.deals = played
+	return elo
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Rate random agents in a duplicate tournament, printing the ratings as JSON')
+	parser.add_argument('--agents', type=int, default=4)
+	parser.add_argument('--deals', type=int, default=1000)
+	parser.add_argument('--processes', type=int)
+	parser.add_argument('--width', type=float, help='stop once every confidence interval is narrower')
+	parser.add_argument('--output', help='file to append the result of every deal to')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+	agents = {'random{}'.format(i): random_agent for i in range(args.agents)}
+	elo = run_tournament(agents, args.deals, args.output, args.processes, width=args.width, seed=args.seed)
+	print(json.dumps({'deals': elo.deals, 'ratings': elo.table()}, indent=2))
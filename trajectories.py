@@ -0,0 +1,178 @@
+import os
+import glob
+import threading
+import numpy as np
+
+# the columns of a trajectory shard, their shape per step and dtype, obs taking the shape of the observations
+COLUMNS = {
+	'obs': ((), np.float32),
+	'legal_cards': ((52,), bool),
+	'legal_calls': ((14,), bool),
+	'legal_trumps': ((4,), bool),
+	'action': ((3,), np.int8),
+	'rewards': ((4,), np.float32),
+	'done': ((), bool),
+	'player': ((), np.int8),
+	'phase': ((), np.int8),
+}
+
+
+class TrajectoryWriter:
+	"""
+	A class which streams the steps of played games to compressed .npz shards for offline training
+
+	Every step appends the observation and legal masks the current player acted on, the action,
+	the rewards of the four seats, whether the game ended, the acting seat and the phase (1 for
+	bidding, 2 for calling and 3 for playing) to preallocated buffers. Once shard_size steps are
+	buffered, the shard is written by a background thread while the next one fills, so writing
+	overlaps playing. Shards are numbered after the ones already in the directory.
+	"""
+	def __init__(self, directory, shard_size=100000, obs_dtype=np.float32, compress=True, prefix='shard'):
+		self.directory = directory
+		self.shard_size = shard_size
+		self.obs_dtype = obs_dtype
+		self.compress = compress
+		self.prefix = prefix
+		os.makedirs(directory, exist_ok=True)
+		self.shard = len(shard_paths(directory, prefix))
+		self.buffers = None
+		self.size = 0
+		self.thread = None
+
+
+	def allocate(self, obs_shape):
+		self.buffers = {}
+		for key, (shape, dtype) in COLUMNS.items():
+			if key == 'obs':
+				shape, dtype = obs_shape, self.obs_dtype
+			self.buffers[key] = np.empty((self.shard_size,) + shape, dtype=dtype)
+
+
+	def add(self, **columns):
+		"""
+		A method which appends a batch of steps, given as arrays of every column with the steps
+		along their first axis, e.g. from a VectorEstimation
+		"""
+		n = len(columns['done'])
+		if self.buffers is None:
+			self.allocate(np.shape(columns['obs'])[1:])
+
+		start = 0
+		while start < n:
+			size = min(n - start, self.shard_size - self.size)
+			for key, buffer in self.buffers.items():
+				buffer[self.size:self.size + size] = columns[key][start:start + size]
+			self.size += size
+			start += size
+			if self.size == self.shard_size:
+				self.flush()
+
+
+	def step(self, env, obs, info, action):
+		"""
+		A method which steps an Estimation instance with an action, records the step and returns
+		what env.step returns
+		"""
+		if self.buffers is None:
+			self.allocate(np.shape(obs))
+
+		player = env.current_player()
+		phase = 1 if env.phase_1 else 2 if env.phase_2 else 3
+		legal = info if 'legal_cards' in info and 'legal_trumps' in info else env.legal_actions()
+		i = self.size
+		self.buffers['obs'][i] = obs
+		self.buffers['legal_cards'][i] = legal['legal_cards']
+		self.buffers['legal_calls'][i] = legal['legal_calls']
+		self.buffers['legal_trumps'][i] = legal['legal_trumps']
+		self.buffers['action'][i] = action
+		self.buffers['player'][i] = list(env.hands).index(player)
+		self.buffers['phase'][i] = phase
+
+		result = env.step(action)
+		_, rewards, done, _ = result
+		self.buffers['rewards'][i] = [rewards.get(seat, 0) for seat in env.hands]
+		self.buffers['done'][i] = done
+
+		self.size += 1
+		if self.size == self.shard_size:
+			self.flush()
+		return result
+
+
+	def flush(self):
+		"""
+		A method which writes the buffered steps to a new shard in the background
+		"""
+		if not self.size:
+			return
+		self.wait()
+		arrays = {key: buffer[:self.size].copy() for key, buffer in self.buffers.items()}
+		path = os.path.join(self.directory, '{}-{:05d}.npz'.format(self.prefix, self.shard))
+		save = np.savez_compressed if self.compress else np.savez
+		self.thread = threading.Thread(target=save, args=(path,), kwargs=arrays)
+		self.thread.start()
+		self.shard += 1
+		self.size = 0
+
+
+	def wait(self):
+		"""
+		A method which waits for the shard being written
+		"""
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+
+	def close(self):
+		"""
+		A method which writes the remaining steps and waits for every shard to be written
+		"""
+		self.flush()
+		self.wait()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def shard_paths(directory, prefix='shard'):
+	"""
+	A function which returns the paths of the shards of a directory in order
+	"""
+	return sorted(glob.glob(os.path.join(directory, prefix + '-*.npz')))
+
+
+def read_trajectories(directory, batch_size=1024, columns=None, shuffle=False, seed=None, prefix='shard'):
+	"""
+	A function which yields mini-batches of steps from the shards of a directory, as dicts of
+	column arrays, loading one shard at a time. A shuffled read goes over the shards and the
+	steps within each shard in random order.
+	"""
+	rng = np.random.default_rng(seed)
+	paths = shard_paths(directory, prefix)
+	if shuffle:
+		paths = [paths[i] for i in rng.permutation(len(paths))]
+
+	pending = None
+	for path in paths:
+		with np.load(path) as shard:
+			arrays = {key: shard[key] for key in columns or shard.files}
+		if shuffle:
+			order = rng.permutation(len(arrays['done' if 'done' in arrays else next(iter(arrays))]))
+			arrays = {key: array[order] for key, array in arrays.items()}
+		if pending is not None:
+			arrays = {key: np.concatenate([pending[key], array]) for key, array in arrays.items()}
+
+		n = len(next(iter(arrays.values())))
+		end = n - n % batch_size
+		for start in range(0, end, batch_size):
+			yield {key: array[start:start + batch_size] for key, array in arrays.items()}
+		pending = {key: array[end:] for key, array in arrays.items()} if end < n else None
+
+	if pending is not None:
+		yield pending
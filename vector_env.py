@@ -0,0 +1,444 @@
+import numpy as np
+from functions import NO_SUIT, SUIT_CARDS, SCORES, trick_winners, sample_actions
+from functions import BIDDER, DASH, REGULAR, RISK, DOUBLERISK, WITH, WITHRISK, WITHDOUBLERISK, ONLYWIN, NOCALL, GE8
+
+# each current position followed by the other three table positions, in table order
+SEATS = np.array([[order] + [k for k in range(4) if k != order] for order in range(4)])
+
+# card locations other than a hand, encoded as in change_state
+ON_TABLE = 2
+PLAYED = 3
+
+
+class VectorEstimation:
+	"""
+	A class representing N games of estimation stepped in lockstep
+
+	The state of every game is held in numpy arrays indexed by game and seat, where seat i
+	is the player at position i of the players list when the games were reset.
+	The rules follow Estimation.step, so a game played here with the same deal and actions
+	yields the same observations, rewards and scores as a single Estimation instance.
+
+	Passing an (N, 52) corpus of deals, e.g. a memory-mapped one from deals.load_deals, deals
+	its rows in order, wrapping around, to every reset and automatic reset instead of random deals.
+	"""
+	def __init__(self, n, auto_reset=False, seed=None, corpus=None):
+		self.n = n
+		self.auto_reset = auto_reset
+		self.games = np.arange(n)
+		self.rng = np.random.default_rng(seed)
+		self.corpus = corpus
+		self.dealt = 0  # rows of the corpus dealt so far
+
+
+	def next_deals(self, n):
+		"""
+		A method which returns the next n deals of the corpus, or n random deals without one
+		"""
+		if self.corpus is None:
+			return np.argsort(self.rng.random((n, 52)), axis=1)
+		rows = np.arange(self.dealt, self.dealt + n) % len(self.corpus)
+		self.dealt += n
+		return self.corpus[rows]
+
+
+	def reset(self, deals=None, seed=None):
+		"""
+		A method which deals new cards to all games and returns the first observations
+
+		deals is an optional (n, 52) array of shuffled card tokens, dealt the same way
+		Estimation.deal_to_players pops cards from the deck, and seed reseeds the random
+		generator of the deals, automatic resets and sample
+		"""
+		if seed is not None:
+			self.rng = np.random.default_rng(seed)
+		if deals is None:
+			deals = self.next_deals(self.n)
+
+		# each player's cards, table cards and locations of the table and previously played cards
+		self.hands = np.zeros((self.n, 4, 52), dtype=bool)
+		self.table = np.full((self.n, 4), -1, dtype=np.int64)
+		self.locations = np.zeros((self.n, 52), dtype=np.int8)  # 2 on the table, 3 played
+
+		# players bids, bid trumps, tricks, score multipliers, scores and rewards
+		self.bids = np.zeros((self.n, 4), dtype=np.int64)
+		self.bid_trumps = np.zeros((self.n, 4), dtype=np.int64)
+		self.tricks = np.zeros((self.n, 4), dtype=np.int64)
+		self.multi = np.zeros((self.n, 4), dtype=np.int64)
+		self.scores = np.zeros((self.n, 4))
+		self.rewards = np.zeros((self.n, 4))
+
+		# table suit, trump suit, total called tricks and highest bid
+		self.table_suit = np.full(self.n, NO_SUIT, dtype=np.int64)
+		self.trump_suit = np.full(self.n, NO_SUIT, dtype=np.int64)
+		self.total_tricks = np.zeros(self.n, dtype=np.int64)
+		self.highest_bid = np.zeros(self.n, dtype=np.int64)
+
+		# seat leading the table, current player order, round no. and phase
+		self.first = np.zeros(self.n, dtype=np.int64)
+		self.order = np.zeros(self.n, dtype=np.int64)
+		self.round = np.zeros(self.n, dtype=np.int64)
+		self.phase = np.ones(self.n, dtype=np.int64)
+		self.done = np.zeros(self.n, dtype=bool)
+
+		# calling order limits set by select_highest_bid
+		self.last_player = np.full(self.n, 3, dtype=np.int64)
+		self.dash_skip = np.full(self.n, -1, dtype=np.int64)
+		self.n_dash = np.zeros(self.n, dtype=np.int64)
+
+		self.deal_to_players(self.games, deals)
+
+		return self.observe(), self.update_info()
+
+
+	def reset_games(self, games, deals=None):
+		"""
+		A method which resets only the given games, used for auto resetting finished games
+		"""
+		if deals is None:
+			deals = self.next_deals(len(games))
+
+		self.hands[games] = False
+		self.table[games] = -1
+		self.locations[games] = 0
+		for arr in (self.bids, self.bid_trumps, self.tricks, self.multi, self.scores, self.rewards):
+			arr[games] = 0
+		self.table_suit[games] = NO_SUIT
+		self.trump_suit[games] = NO_SUIT
+		for arr in (self.total_tricks, self.highest_bid, self.first, self.order, self.round, self.n_dash):
+			arr[games] = 0
+		self.phase[games] = 1
+		self.done[games] = False
+		self.last_player[games] = 3
+		self.dash_skip[games] = -1
+
+		self.deal_to_players(games, deals)
+
+
+	def set_game(self, env, hands):
+		"""
+		A method which sets every game to the playing phase state of an Estimation instance,
+		with the given (n, 4, 52) hands, seat i being the i-th player of env.hands
+		"""
+		self.reset(np.tile(np.arange(52), (self.n, 1)))
+		seats = {player: i for i, player in enumerate(env.hands)}
+
+		self.hands[:] = hands
+		self.table[:, :len(env.table)] = env.table
+		self.locations[:, env.played] = PLAYED
+		self.locations[:, env.table] = ON_TABLE
+		for player, seat in seats.items():
+			self.bids[:, seat] = env.bids[player]
+			self.tricks[:, seat] = sum(env.tricks[player])
+			self.multi[:, seat] = env.multi.bits[env.seats[player]]
+			self.rewards[:, seat] = env.rewards.get(player, 0)
+
+		self.table_suit[:] = env.table_suit_token
+		self.trump_suit[:] = env.trump_suit_token
+		self.total_tricks[:] = env.total_tricks
+		self.highest_bid[:] = env.highest_bid
+		self.first[:] = seats[env.players[0]]
+		self.order[:] = env.order
+		self.round[:] = env.round
+		self.phase[:] = 3
+
+
+	def deal_to_players(self, games, deals):
+		"""
+		A method which gives each seat 13 cards, seat i taking deck[51 - i], deck[47 - i], ...
+		"""
+		deals = np.asarray(deals)
+		for seat in range(4):
+			self.hands[games[:, None], seat, deals[:, 51 - seat::-4]] = True
+
+
+	def step(self, actions):
+		"""
+		The actions argument should be an (n, 3) array whose rows contain:
+		1. a card to be played
+		2. an estimation of tricks
+		3. a trump suit
+
+		Games which are already done ignore their actions
+		"""
+		actions = np.asarray(actions, dtype=np.int64)
+		phase = np.where(self.done, 0, self.phase)
+		bidding, calling, playing = (self.games[phase == i] for i in (1, 2, 3))
+
+		# Phase 1
+		if len(bidding):
+			self.bid(bidding, actions[bidding])
+
+		# Phase 2
+		if len(calling):
+			self.call(calling, actions[calling])
+
+		# Phase 3
+		if len(playing):
+			self.play_card(playing, actions[playing])
+
+		rewards = self.rewards.copy()
+		dones = self.done.copy()
+
+		# finished games keep their rewards, while their info describes the new deals like their observations
+		if self.auto_reset and dones.any():
+			finished = self.games[dones]
+			final_scores = self.scores[finished].copy()
+			self.reset_games(finished)
+			info = self.update_info()
+			info['final_scores'] = final_scores
+			info['final_games'] = finished
+		else:
+			info = self.update_info()
+
+		return self.observe(), rewards, dones, info
+
+
+	def current_player(self):
+		"""
+		A method which returns the seat of the current player in every game
+		"""
+		return (self.first + self.order) & 3
+
+
+	def bid(self, games, actions):
+		"""
+		A method which adds the bids of phase 1 and selects the highest bid after the last one
+		"""
+		seats = self.order[games]  # the first seat leads the bidding
+		self.bids[games, seats] = actions[:, 1]
+		self.bid_trumps[games, seats] = actions[:, 2]
+
+		last = seats == 3
+		self.order[games[~last]] += 1
+		if last.any():
+			self.select_highest_bid(games[last])
+
+
+	def select_highest_bid(self, games):
+		"""
+		A method which determines the highest bidding seat and sets up the calling order
+		"""
+		bids = self.bids[games]
+		trumps = self.bid_trumps[games]
+
+		# the first two players who bid zero dash
+		zeros = bids == 0
+		dashed = zeros & (np.cumsum(zeros, axis=1) <= 2)
+		self.multi[games] |= np.where(dashed, DASH, 0)
+		n_dash = dashed.sum(axis=1)
+
+		# highest estimation wins, ties go to the higher trump and then to the earlier bid
+		keys = np.where(zeros, -1, bids * 4 + trumps)
+		if (keys.max(axis=1) < 0).any():
+			raise ValueError('every player dashed, there is no highest bid')
+		highest = np.argmax(keys, axis=1)
+		rows = np.arange(len(games))
+		max_est = bids[rows, highest]
+
+		self.multi[games, highest] |= BIDDER
+		self.bids[games] = 0
+		self.bids[games, highest] = max_est
+		self.highest_bid[games] = max_est
+		self.trump_suit[games] = trumps[rows, highest]
+		self.total_tricks[games] += max_est
+		self.first[games] = highest
+
+		# calling order, skipping the dashing players
+		order = np.ones(len(games), dtype=np.int64)
+		last_player = np.full(len(games), 3, dtype=np.int64)
+		dash_skip = np.full(len(games), -1, dtype=np.int64)
+
+		positions = np.where(dashed, (np.arange(4) - highest[:, None]) & 3, 0)
+		single = n_dash == 1
+		position = positions.sum(axis=1)
+		order[single & (position == 1)] = 2
+		last_player[single & (position == 3)] = 2
+		dash_skip[single] = position[single]
+
+		double = n_dash == 2
+		last_player[double] = 6 - position[double]
+		order[double] = last_player[double]
+
+		self.order[games] = order
+		self.last_player[games] = last_player
+		self.dash_skip[games] = dash_skip
+		self.n_dash[games] = n_dash
+		self.phase[games] = 2
+
+
+	def call(self, games, actions):
+		"""
+		A method which takes the estimations of phase 2 and adds score multipliers
+		"""
+		call = actions[:, 1]
+		order = self.order[games]
+		seats = (self.first[games] + order) & 3
+		total = call + self.total_tricks[games]
+		last = order >= self.last_player[games]
+		with_bid = call == self.highest_bid[games]
+
+		multi = np.where(with_bid, WITH, 0)
+		multi = np.where(last & with_bid & (total == 15), WITHRISK, multi)
+		multi = np.where(last & with_bid & (total > 15), WITHDOUBLERISK, multi)
+		other = last & ~with_bid & (call != 0)
+		multi = np.where(other, REGULAR, multi)
+		multi = np.where(other & (total == 15), RISK, multi)
+		multi = np.where(other & (total > 15), DOUBLERISK, multi)
+		multi |= np.where(call == 0, NOCALL, np.where(call >= 8, GE8, 0))
+
+		self.multi[games, seats] |= multi
+		self.bids[games, seats] = call
+		self.total_tricks[games] = total
+
+		# advance the order, skipping a single dashing player
+		order = order + 1
+		order = np.where((self.n_dash[games] > 0) & (order == self.dash_skip[games]), order + 1, order)
+		self.order[games] = np.where(last, 0, order)
+		self.phase[games[last]] = 3
+
+
+	def play_card(self, games, actions):
+		"""
+		A method to play a card in every game and evaluate the tricks of completed tables
+		"""
+		cards = actions[:, 0]
+		order = self.order[games]
+		seats = (self.first[games] + order) & 3
+		if not self.hands[games, seats, cards].all():
+			raise ValueError('a played card is not in the hand of the current player')
+
+		self.hands[games, seats, cards] = False
+		self.table[games, order] = cards
+		self.locations[games, cards] = ON_TABLE
+
+		# declare table suit if it was the first card on the table
+		leading = order == 0
+		self.table_suit[games[leading]] = cards[leading] // 13
+
+		order = order + 1
+		self.order[games] = order & 3
+		full = games[order > 3]
+		if len(full):
+			self.round[full] += 1
+			winners = self.evaulate_winner(full)
+			self.tricks[full, winners] += 1
+			self.first[full] = winners
+			self.locations[full[:, None], self.table[full]] = PLAYED
+			self.table[full] = -1
+			self.table_suit[full] = NO_SUIT
+			self.rewards[full] = self.calculate_rewards(full)
+
+			over = full[self.round[full] == 13]
+			if len(over):
+				self.done[over] = True
+				self.phase[over] = 4
+				self.post_game_multi(over)
+				self.scores[over] = self.update_scores(over)
+
+
+	def evaulate_winner(self, games):
+		"""
+		A method which returns the winning seat of the full tables of the given games
+		"""
+		position = trick_winners(self.table[games], self.trump_suit[games])
+		return (self.first[games] + position) & 3
+
+
+	def post_game_multi(self, games):
+		"""
+		A method which adds the onlywin multiplier to the only seat which got its estimation
+		"""
+		outcomes = self.bids[games] == self.tricks[games]
+		onlywin = outcomes & (outcomes.sum(axis=1) == 1)[:, None]
+		self.multi[games] |= np.where(onlywin, ONLYWIN, 0)
+
+
+	def update_scores(self, games, reward=False):
+		"""
+		A method which returns the (games, 4) scores of the given games according to tricks and multipliers
+		"""
+		estimated = self.bids[games]
+		actual = estimated if reward else self.tricks[games]
+		return SCORES[self.multi[games], estimated, actual].astype(float)
+
+
+	def calculate_rewards(self, games):
+		"""
+		A method which calculates the rewards of the given games as potential of their optimistic score
+		"""
+		e_scores = self.update_scores(games, reward=True)
+		scores = self.update_scores(games)
+		r_rounds = (13 - self.round[games])[:, None]
+		bids = self.bids[games]
+		tricks = self.tricks[games]
+		r_tricks = bids - tricks
+
+		r_p_trick = np.divide(e_scores, bids, out=scores.copy(), where=bids != 0)
+		rewards = np.where(r_rounds >= r_tricks, tricks * r_p_trick, scores)
+		return np.where(r_tricks < 0, scores, rewards)
+
+
+	def observe(self):
+		"""
+		A method which returns the (n, 65) observations of the current players, laid out as change_state
+		"""
+		rows = self.games[:, None]
+		seats = (self.first[:, None] + SEATS[self.order]) & 3  # current player first
+		bids = np.where((self.phase > 1)[:, None], self.bids[rows, seats], 0)
+		tricks = self.tricks[rows, seats]
+
+		state = np.empty((self.n, 65))
+		state[:, :52] = self.locations + self.hands[rows[:, 0], seats[:, 0]]
+		state[:, 52:60:2] = bids
+		state[:, 53:60:2] = tricks
+		state[:, 60:] = np.stack([self.table_suit, self.trump_suit, self.total_tricks, self.round, self.order], axis=1)
+
+		return state
+
+
+	def legal_actions(self):
+		"""
+		A method which returns boolean masks of the legal cards (n, 52), calls (n, 14) and trumps (n, 4)
+		"""
+		rows = self.games
+		hands = self.hands[rows, self.current_player()]
+
+		# players must follow the table suit if they can
+		follow = hands & SUIT_CARDS[self.table_suit]
+		cards = np.where(follow.any(axis=1, keepdims=True), follow, hands)
+
+		# a third dash and the call making the total tricks 13 are illegal
+		calls = np.ones((self.n, 14), dtype=bool)
+		bidding = self.phase == 1
+		dashes = ((self.bids == 0) & (np.arange(4) < self.order[:, None])).sum(axis=1)
+		calls[bidding & (dashes > 1), 0] = False
+		illegal = 13 - self.total_tricks
+		last_call = (self.phase == 2) & (self.order >= self.last_player) & (illegal >= 0) & (illegal < 14)
+		calls[rows[last_call], illegal[last_call]] = False
+
+		trumps = np.ones((self.n, 4), dtype=bool)
+
+		return {'legal_cards': cards, 'legal_calls': calls, 'legal_trumps': trumps}
+
+
+	def update_info(self):
+		"""
+		A method which returns a dict of arrays containing the current seats, phases, rounds,
+		done flags, final scores and legal action masks of all games
+		"""
+		info = {}
+		info['current_player'] = self.current_player()
+		info['phase'] = self.phase.copy()
+		info['round'] = self.round.copy()
+		info['scores'] = self.scores.copy()
+		info.update(self.legal_actions())
+
+		return info
+
+
+	def sample(self, info):
+		"""
+		A method which randomly samples an (n, 3) array of legal actions from the masks in info
+		"""
+		return sample_actions(info, self.rng)